@@ -0,0 +1,57 @@
+import json
+import os
+import platform
+import subprocess
+import time
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(latencies, elapsed, errors=0):
+    """
+    Summarises a list of latencies (seconds) measured within elapsed seconds, latencies are reported in milliseconds.
+    """
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+def commit():
+    try:
+        return (
+            subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, check=True)
+            .stdout.decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write(results, output, parameters):
+    """
+    Writes results as json together with the commit and the parameters they were measured with, so runs of different
+    commits can be compared.
+    """
+    document = {
+        "commit": commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(document, file, indent=2)
+    return document
@@ -0,0 +1,168 @@
+"""
+Drives all endpoints of the configserver against local github and vault stand-ins.
+
+    python -m benchmark.loadtest --concurrency 50 --requests 2000 --latency 0.02 --output bench/loadtest.json
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import yaml
+
+from benchmark import common
+from test.fakegithub import FakeGithub
+from test.fakevault import FakeVault
+
+endpoints = [
+    "/{application}/{profile}/main",
+    "/{application}/{profile}",
+    "/{application}-{profile}.yml",
+    "/{application}-{profile}.properties",
+    "/{application}-{profile}.json",
+    "/{application}.json",
+]
+
+
+def syntheticFiles(applications, profiles, keys):
+    files = {}
+    for application in applications + ["application"]:
+        body = {"app": {application: {f"key{i}": f"value{i}" for i in range(keys)}}}
+        files[f"{application}.yaml"] = yaml.dump(body).encode("utf-8")
+        for profile in profiles:
+            files[f"{application}-{profile}.properties"] = "\n".join(
+                f"{application}.{profile}.key{i}=value{i}" for i in range(keys)
+            ).encode("utf-8")
+    return files
+
+
+def syntheticSecrets(applications, profiles):
+    secrets = {}
+    for application in applications + ["application"]:
+        secrets[application] = {"password": f"{application}-secret"}
+        for profile in profiles:
+            secrets[f"{application},{profile}"] = {"password": f"{application}-{profile}"}
+    return secrets
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def startServer(github, vault, workdir, workers):
+    configfile = os.path.join(workdir, "configserver.yaml")
+    with open(configfile, "w") as file:
+        yaml.dump(
+            {
+                "vault": vault.url,
+                "config": [{"prefix": "default", "github": "bench/config", "vault": "secret"}],
+            },
+            file,
+        )
+    port = freePort()
+    env = {**os.environ, "CONFIGFILE": configfile, "GITHUB_API_URL": github.url}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "configserver:app",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=root,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("configserver did not start")
+
+
+async def drive(url, path, concurrency, requests, headers):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(path)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        await client.get(path, headers=headers)
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return common.summary(latencies, elapsed, errors)
+
+
+async def run(arguments):
+    applications = [f"app{i}" for i in range(arguments.applications)]
+    profiles = ["dev", "prod"]
+    github = FakeGithub(
+        {"bench/config": {"main": syntheticFiles(applications, profiles, arguments.keys)}},
+        latency=arguments.latency,
+    ).start()
+    vault = FakeVault(
+        {"secret": syntheticSecrets(applications, profiles)}, latency=arguments.latency
+    ).start()
+    headers = {"x-config-token": "token"} if arguments.vault else {}
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        process, url = startServer(github, vault, workdir, arguments.workers)
+        try:
+            for endpoint in endpoints:
+                path = endpoint.format(application=applications[0], profile="dev")
+                results[endpoint] = await drive(
+                    url, path, arguments.concurrency, arguments.requests, headers
+                )
+                results[endpoint]["upstreamRequests"] = len(github.requests) + len(vault.requests)
+                github.requests.clear()
+                vault.requests.clear()
+                print(endpoint, results[endpoint])
+        finally:
+            process.terminate()
+            process.wait()
+            github.stop()
+            vault.stop()
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--latency", type=float, default=0.02, help="injected upstream latency in seconds")
+    parser.add_argument("--applications", type=int, default=10)
+    parser.add_argument("--keys", type=int, default=100, help="keys per synthetic config file")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-vault", dest="vault", action="store_false")
+    parser.add_argument("--output", default="bench/loadtest.json")
+    arguments = parser.parse_args(argv)
+    results = asyncio.run(run(arguments))
+    common.write(results, arguments.output, vars(arguments))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+Microbenchmarks for flatten, generateSearchPaths and generateWideMap on large synthetic configs.
+
+    python -m benchmark.microbench --keys 5000 --depth 6 --output bench/microbench.json
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+from benchmark import common
+
+if "CONFIGFILE" not in os.environ:
+    os.environ["CONFIGFILE"] = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configserver.yaml"
+    )
+import configserver
+
+
+def nested(keys, depth, width=10):
+    """
+    Builds a nested dict with keys leaves, each at the given depth.
+    """
+    tree = {}
+    for i in range(keys):
+        node = tree
+        path = [f"level{d}_{(i // width ** d) % width}" for d in range(depth - 1)]
+        for item in path:
+            node = node.setdefault(item, {})
+        node[f"key{i}"] = f"value{i}"
+    return tree
+
+
+def measure(function, number):
+    timings = timeit.repeat(function, number=number, repeat=5)
+    best = min(timings) / number
+    return {"number": number, "best": round(best * 1000, 4), "unit": "ms"}
+
+
+def run(arguments):
+    tree = nested(arguments.keys, arguments.depth)
+    flat = configserver.flatten(tree)
+    applications = [f"app{i}" for i in range(arguments.applications)] + ["application"]
+    profiles = [f"profile{i}" for i in range(arguments.profiles)]
+    labels = [f"label{i}" for i in range(arguments.labels)]
+    return {
+        "flatten": measure(lambda: configserver.flatten(tree), arguments.number),
+        "generateWideMap": measure(lambda: configserver.generateWideMap(flat), arguments.number),
+        "generateSearchPaths": measure(
+            lambda: configserver.generateSearchPaths(
+                applications, profiles, labels, configserver.fileendings
+            ),
+            arguments.number * 10,
+        ),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=5000)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--applications", type=int, default=2)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--labels", type=int, default=3)
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--output", default="bench/microbench.json")
+    arguments = parser.parse_args(argv)
+    start = time.perf_counter()
+    results = run(arguments)
+    for name, result in results.items():
+        print(name, result)
+    common.write(results, arguments.output, vars(arguments))
+    print(f"took {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded mapping which evicts the least recently used entry once maxsize is reached.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TTLCache(LRUCache):
+    """
+    A LRUCache whose entries expire ttl seconds after they were put.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, clock=time.monotonic):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < self.clock():
+            self.entries.pop(key, None)
+            self.hits -= 1
+            self.misses += 1
+            return default
+        return value
+
+    def put(self, key, value, ttl=None):
+        super().put(key, (self.clock() + (self.ttl if ttl is None else ttl), value))
+        return value
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] >= self.clock()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the work, everybody arriving before it is
+    done awaits the same result. Nothing is kept once the call finished.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, function):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(function())
+            self.calls[key] = future
+            future.add_done_callback(lambda done: self.forget(key, done))
+        # a cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(future)
+
+    def forget(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+
+    def __len__(self):
+        return len(self.calls)
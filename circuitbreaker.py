@@ -0,0 +1,69 @@
+import time
+
+
+class Open(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing upstream. After threshold consecutive failures the circuit opens and calls fail fast,
+    every cooldown seconds a single call is let through as a probe: its success closes the circuit again, a failure
+    keeps it open for another cooldown.
+    """
+
+    def __init__(self, name, threshold=5, cooldown=30, clock=time.monotonic):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.openeduntil = None
+        self.probing = False
+
+    @property
+    def state(self):
+        if self.openeduntil is None:
+            return "closed"
+        if self.probing or self.clock() >= self.openeduntil:
+            return "halfopen"
+        return "open"
+
+    def check(self):
+        """
+        Raises Open unless a call may be made now. Once the cooldown passed the first caller becomes the probe.
+        """
+        if self.openeduntil is None:
+            return
+        if self.probing or self.clock() < self.openeduntil:
+            raise Open(f"{self.name} is unavailable, circuit open")
+        self.probing = True
+
+    def success(self):
+        self.failures = 0
+        self.openeduntil = None
+        self.probing = False
+
+    def release(self):
+        """
+        Ends a call that neither succeeded nor failed (it was cancelled), a probe may be made again right away.
+        """
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            self.openeduntil = self.clock() + self.cooldown
+        self.probing = False
+
+
+breakers = {}
+
+
+def getBreaker(name, threshold=5, cooldown=30):
+    """
+    Returns the breaker of an upstream (a repository, mirror or vault address), shared by all prefixes using it.
+    """
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name, threshold, cooldown)
+    return breakers[name]
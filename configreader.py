@@ -2,6 +2,29 @@ import yaml
 readconfig = {}
 default_repo = "joe255/testconfig-repo"
 vaultaddress = "http://locahost:8200"
+cachesettings = {"refttl": 30, "maxentries": 1024, "vaultclients": 64,
+                 "shared": None, "leasetime": 10, "sharedmaxentries": 100000}
+metricssettings = {"servertiming": False}
+warmupsettings = {"enabled": False, "labels": ["main"]}
+# below reserve remaining github requests refs are only re-checked every refttl seconds
+ratelimitsettings = {"reserve": 100, "refttl": 300}
+# watched requests are checked every interval seconds, long-polls wait at most timeout seconds
+watchsettings = {"interval": 10, "timeout": 60, "keepalive": 30}
+# secret of the github push webhook on /monitor and the bearer token of /refresh, None disables the check / endpoint
+monitorsettings = {"secret": None, "token": None}
+# a backend failing threshold times in a row is not asked again for cooldown seconds
+circuitbreakersettings = {"threshold": 5, "cooldown": 30}
+# optional per prefix settings, dicts are merged key by key with the configured values
+prefixdefaults = {
+    "timeout": {"github": 10, "vault": 5},
+    "policy": {"github": "partial", "vault": "partial"},
+    "vaultcache": {"enabled": False, "ttl": 30},
+    "stale": {"enabled": False, "fresh": 5, "maxage": 3600},
+    "source": "github",
+    "mirror": {"url": None, "path": "mirrors", "interval": 60},
+    "native": {"path": "springconfig", "interval": 0},
+    "searchpaths": [],
+}
 
 def init(configfile='configserver.yaml'):
     # read config from file
@@ -12,9 +35,17 @@ def init(configfile='configserver.yaml'):
             config = yaml.load(file, Loader=yaml.FullLoader)
             for entry in config['config']:
                 readconfig[entry['prefix']] = {
-                    "github": entry['github'], "vault": entry['vault']}
+                    "github": entry['github'], "vault": entry['vault'],
+                    **{key: entry[key] for key in prefixdefaults if key in entry}}
             global vaultaddress
             vaultaddress = config['vault']
+            cachesettings.update(config.get('cache') or {})
+            metricssettings.update(config.get('metrics') or {})
+            warmupsettings.update(config.get('warmup') or {})
+            ratelimitsettings.update(config.get('ratelimit') or {})
+            circuitbreakersettings.update(config.get('circuitbreaker') or {})
+            watchsettings.update(config.get('watch') or {})
+            monitorsettings.update(config.get('monitor') or {})
     except Exception as e:
         print(e)
     if not "default" in readconfig:
@@ -24,8 +55,39 @@ def init(configfile='configserver.yaml'):
 
 def getConfig():
     return readconfig
+
+def getPrefixConfig(prefix):
+    conf = dict(getConfig()[prefix])
+    for key, default in prefixdefaults.items():
+        if isinstance(default, dict):
+            conf[key] = {**default, **(conf.get(key) or {})}
+        elif key not in conf:
+            conf[key] = default
+    return conf
+
 def getVaultAddress():
     return vaultaddress
 
+def getCacheSettings():
+    return cachesettings
+
+def getMetricsSettings():
+    return metricssettings
+
+def getWarmupSettings():
+    return warmupsettings
+
+def getRateLimitSettings():
+    return ratelimitsettings
+
+def getCircuitBreakerSettings():
+    return circuitbreakersettings
+
+def getWatchSettings():
+    return watchsettings
+
+def getMonitorSettings():
+    return monitorsettings
+
 def setConfig(conf):
     readconfig = conf
@@ -1,20 +1,38 @@
+import asyncio
 import getopt
+import hashlib
+import hmac
+import json
+import logging
 import os
+import re
 import sys
-from collections.abc import MutableMapping
-from typing import Optional
+import time
+from typing import List, Optional
 
-import github
+import httpx
 import hvac
-import yaml
-from fastapi import FastAPI, Header, Response
-from github import Github
+import requests
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
+import cache
+import circuitbreaker
 import configreader
+import gitmirror
+import githubclient
+import metrics
+import nativesource
+import parsers
+import render
+import sharedcache
+import vaultclient
+import watch
+from render import generateWideMap
 
-githubtoken = "" if not "GITHUB_TOKEN" in os.environ else os.environ["VAULT_TOKEN"]
-g = Github(login_or_token=githubtoken)
 fileendings = ["yaml", "yml", "properties"]
+logger = logging.getLogger("configserver")
 
 
 def main(argv):
@@ -29,6 +47,386 @@ def main(argv):
 if __name__ == "__main__" or __name__ == "configserver":
     main(sys.argv[1:])
 app = FastAPI()
+# invalidations running in the background, see /monitor and /refresh
+refreshtasks = set()
+
+
+async def cancelRefreshes():
+    for task in list(refreshtasks):
+        task.cancel()
+    await asyncio.gather(*refreshtasks, return_exceptions=True)
+
+
+# background refreshes have to stop before the clients they use are closed
+app.add_event_handler("shutdown", cancelRefreshes)
+app.add_event_handler("shutdown", githubclient.close)
+app.add_event_handler("shutdown", gitmirror.close)
+# label -> commit sha, expires so that moved branches are picked up
+refcache = cache.TTLCache(
+    maxsize=configreader.getCacheSettings()["maxentries"],
+    ttl=configreader.getCacheSettings()["refttl"],
+)
+# label -> last commit sha github answered, served while github rate limits us
+knownrefs = cache.LRUCache(maxsize=configreader.getCacheSettings()["maxentries"])
+# (repository, commit sha) -> {path: blob sha}, commits are immutable
+listingcache = cache.LRUCache(maxsize=configreader.getCacheSettings()["maxentries"])
+# (blob sha, format) -> parsed property source, blobs are immutable and the same in every repository
+sourcecache = cache.LRUCache(maxsize=configreader.getCacheSettings()["maxentries"])
+# refs, listings and parsed sources shared by all workers of the host, see cache.shared
+shared = (
+    sharedcache.SharedCache(
+        configreader.getCacheSettings()["shared"],
+        configreader.getCacheSettings()["leasetime"],
+        configreader.getCacheSettings()["sharedmaxentries"],
+    )
+    if configreader.getCacheSettings()["shared"]
+    else None
+)
+vaultclient.clients.maxsize = configreader.getCacheSettings()["vaultclients"]
+vaultclient.secretcache.maxsize = configreader.getCacheSettings()["maxentries"]
+nativesource.directories.maxsize = configreader.getCacheSettings()["maxentries"]
+# (vault address, mount, path, version) -> flattened secret data
+secretsources = cache.LRUCache(maxsize=configreader.getCacheSettings()["maxentries"])
+# identical requests in flight at the same time share one combine
+inflight = cache.SingleFlight()
+# lookups of the same ref, tree, blob or secret in flight at the same time share one upstream call, whichever
+# prefixes they come from
+fetches = cache.SingleFlight()
+warmupstate = {"done": False, "task": None}
+# combine key -> (time, combined) of the last complete answer, see the stale prefix settings
+snapshots = cache.LRUCache(maxsize=configreader.getCacheSettings()["maxentries"])
+# combine key -> background task refreshing its snapshot
+refreshing = {}
+# watched requests, checked in one shared loop
+detector = watch.ChangeDetector(
+    configreader.getWatchSettings()["interval"], lambda sources: refreshSources(sources)
+)
+app.add_event_handler("shutdown", detector.close)
+metrics.registerCache("ref", refcache)
+metrics.registerCache("listing", listingcache)
+metrics.registerCache("source", sourcecache)
+metrics.registerCache("vaultsecret", vaultclient.secretcache)
+metrics.registerCache("render", render.renders)
+metrics.registerCache("snapshot", snapshots)
+metrics.registerCache("vaultsource", secretsources)
+if shared is not None:
+    metrics.registerCache("shared", shared)
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    prefix = request.headers.get("prefix", "default")
+    if prefix not in configreader.getConfig():
+        # the header is chosen by the client, unknown values must not create new label sets
+        prefix = "unknown"
+    entries = [] if configreader.getMetricsSettings()["servertiming"] else None
+    metrics.timings.set(entries)
+    metrics.inflightRequests.inc(prefix=prefix)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        duration = time.perf_counter() - start
+        metrics.inflightRequests.dec(prefix=prefix)
+        metrics.requestLatency.observe(
+            duration, prefix=prefix, method=request.method, status=status
+        )
+    if entries is not None:
+        response.headers["Server-Timing"] = metrics.serverTiming(
+            entries + [("total", duration)]
+        )
+    return response
+
+
+@app.get("/ready")
+async def endpoint_ready():
+    """
+    Readiness of the server, reported once the warm-up finished.
+    """
+    if not warmupstate["done"]:
+        return Response(
+            content='{"status":"WARMING_UP"}',
+            status_code=503,
+            media_type="application/json",
+        )
+    return {"status": "UP"}
+
+
+@app.get("/metrics")
+async def endpoint_metrics():
+    """
+    Exposes the instrumentation of the server in the prometheus text format.
+    """
+    for key in ("limit", "remaining", "reset", "notmodified", "throttled"):
+        if githubclient.ratelimit[key] is not None:
+            metrics.githubRateLimit.set(githubclient.ratelimit[key], kind=key)
+    for name, breaker in circuitbreaker.breakers.items():
+        metrics.circuitState.set(int(breaker.state != "closed"), backend=name)
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/watch/{application}/{profile}/{label}")
+async def endpoint_watch(
+    application: str,
+    profile: str,
+    label: str,
+    version: Optional[str] = None,
+    timeout: Optional[float] = None,
+    prefix: Optional[str] = Header("default"),
+    x_config_token: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+):
+    """
+    Notifies about changes of the resolved commits or vault versions behind application/profile/label.
+    As a long-poll it answers {"version": ...} once the version differs from the given one and 304 after timeout
+    seconds without a change. With Accept: text/event-stream it streams a "change" event for every new version.
+    :param version: The version the client has, as returned in the environment. Without it the current version is
+    answered right away.
+    """
+    settings = configreader.getPrefixConfig(prefix)
+    watchsettings = configreader.getWatchSettings()
+    profiles = profile.split(",")
+    labels = label.split(",")
+    applications = [application, "application"]
+    key = combineKey(
+        settings,
+        settings["github"],
+        settings["vault"],
+        applications,
+        profiles,
+        labels,
+        x_config_token,
+    )
+
+    async def check():
+        combined = await combine(
+            applications=applications,
+            profiles=profiles,
+            labels=labels,
+            x_config_token=x_config_token,
+            github=settings["github"],
+            vault=settings["vault"],
+            settings=settings,
+            prefix=prefix,
+            allowstale=False,
+        )
+        return combined["version"]
+
+    sources = []
+    if settings["source"] == "github":
+        sources = [("ref", settings["github"], label) for label in labels]
+    payload = {"name": application, "profiles": profiles, "label": label}
+    if accept and "text/event-stream" in accept:
+        return StreamingResponse(
+            watch.events(
+                detector,
+                key,
+                version,
+                check,
+                watchsettings["keepalive"],
+                sources,
+                payload,
+            ),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+    if timeout is None or timeout > watchsettings["timeout"]:
+        timeout = watchsettings["timeout"]
+    changed = await detector.wait(key, version, check, timeout, sources)
+    if changed is None:
+        return Response(status_code=304)
+    return {**payload, "version": changed}
+
+
+@app.post("/monitor")
+async def endpoint_monitor(
+    request: Request,
+    x_github_event: Optional[str] = Header(None),
+    x_hub_signature_256: Optional[str] = Header(None),
+):
+    """
+    Receives github push webhooks (like the spring cloud config monitor). The pushed ref of the repository is
+    invalidated in every prefix using it and resolved and prefetched again in the background, watchers are notified
+    right away. With monitor.secret set the payload signature is verified.
+    :return: The names of the applications whose configuration changed, "*" for application.* files.
+    """
+    body = await request.body()
+    secret = configreader.getMonitorSettings()["secret"]
+    if secret:
+        digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        signature = f"sha256={digest}"
+        if not hmac.compare_digest(signature, x_hub_signature_256 or ""):
+            raise HTTPException(status_code=401, detail="invalid signature")
+    if x_github_event not in (None, "push"):
+        return []
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="payload is not json")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="payload is not an object")
+    repository = (payload.get("repository") or {}).get("full_name")
+    ref = payload.get("ref") or ""
+    if not repository or not ref.startswith(("refs/heads/", "refs/tags/")):
+        return []
+    label = ref.split("/", 2)[2]
+    prefixes = [
+        prefix
+        for prefix in configreader.getConfig()
+        if configreader.getPrefixConfig(prefix)["github"] == repository
+    ]
+    if not prefixes:
+        return []
+    await invalidate(repository, [label])
+    background(refreshPrefixes(prefixes, [label], repository))
+    paths = [
+        path
+        for commit in payload.get("commits") or []
+        for kind in ("added", "modified", "removed")
+        for path in commit.get(kind) or []
+    ]
+    return changedApplications(paths)
+
+
+@app.post("/refresh")
+async def endpoint_refresh(
+    prefix: Optional[str] = Header("default"),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Drops every cached ref, vault secret and snapshot of a prefix and prefetches it again in the background. Needs
+    the bearer token configured in monitor.token.
+    """
+    token = configreader.getMonitorSettings()["token"]
+    if not token:
+        raise HTTPException(status_code=403, detail="refresh is disabled")
+    if not hmac.compare_digest(f"Bearer {token}", authorization or ""):
+        raise HTTPException(status_code=401, detail="invalid token")
+    if prefix not in configreader.getConfig():
+        raise HTTPException(status_code=404, detail=f"unknown prefix {prefix}")
+    settings = configreader.getPrefixConfig(prefix)
+    warmuplabels = set(configreader.getWarmupSettings()["labels"])
+    labels = await invalidate(settings["github"]) | warmuplabels
+    # the warm-up labels may be cached by other instances only
+    await invalidate(settings["github"], warmuplabels)
+    vaultclient.forgetSecrets(configreader.getVaultAddress(), settings["vault"])
+    if settings["source"] == "native":
+        for label in labels:
+            if not isPathSegment(label):
+                continue
+            directory = nativesource.getDirectory(
+                nativePath(settings["native"], label),
+                settings["native"].get("interval", 0),
+            )
+            directory.files.clear()
+    labels = sorted(labels)
+    background(refreshPrefixes([prefix], labels, settings["github"]))
+    return Response(
+        content=json.dumps({"prefix": prefix, "labels": labels}),
+        status_code=202,
+        media_type="application/json",
+    )
+
+
+async def invalidate(repository, labels=None):
+    """
+    Drops the cached refs of repository (only of labels if given), in memory and in the shared cache, and the
+    snapshots built from them. Trees and parsed files are keyed by sha and stay valid. Returns the labels that were
+    cached in memory.
+    """
+    dropped = set()
+    for key in list(refcache.entries):
+        if key[0] == repository and (labels is None or key[1] in labels):
+            refcache.pop(key)
+            dropped.add(key[1])
+    for key in list(snapshots.entries):
+        if key[1] == repository and (labels is None or set(key[5]) & set(labels)):
+            snapshots.pop(key)
+    if shared is not None:
+        for label in dropped if labels is None else labels:
+            await asyncio.to_thread(shared.delete, f"ref:{repository}:{label}")
+    return dropped
+
+
+async def refreshPrefixes(prefixes, labels, repository):
+    """
+    Resolves and prefetches labels of prefixes again after an invalidation (mirrors are fetched first), then checks
+    the watched requests right away instead of waiting for the next round.
+    """
+    try:
+        jobs = {}
+        for prefix in prefixes:
+            settings = configreader.getPrefixConfig(prefix)
+            for label in labels:
+                if settings["source"] == "native":
+                    if not isPathSegment(label):
+                        continue
+                    key = ("native", nativePath(settings["native"], label))
+                else:
+                    key = (settings["source"], settings["github"], label)
+                jobs.setdefault(key, (prefix, settings, label))
+        mirrors = {
+            mirrorFor(settings["github"], settings["mirror"])
+            for _, settings, _ in jobs.values()
+            if settings["source"] == "mirror"
+        }
+        for local in mirrors:
+            await local.ensure()
+            await local.fetch()
+        results = await asyncio.gather(
+            *[prefetch(settings, label) for _, settings, label in jobs.values()],
+            return_exceptions=True,
+        )
+        for (prefix, _, label), result in zip(jobs.values(), results):
+            if isinstance(result, Exception):
+                logger.warning(f"refresh: {prefix} {label} failed: {result}")
+        if detector.watches:
+            await detector.check()
+    except Exception as e:
+        logger.warning(f"refresh: {repository} failed: {e}")
+
+
+def background(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    refreshtasks.add(task)
+    task.add_done_callback(refreshtasks.discard)
+    return task
+
+
+def changedApplications(paths):
+    """
+    Guesses the applications affected by changed files like the spring cloud config monitor: test-dev.yml changes
+    "test" and "test-dev", application*.yml changes everything ("*").
+    """
+    names = set()
+    for path in paths:
+        name, _, ending = path.rsplit("/", 1)[-1].rpartition(".")
+        if ending not in fileendings:
+            continue
+        if name == "application" or name.startswith("application-"):
+            names.add("*")
+            continue
+        parts = name.split("-")
+        names.update("-".join(parts[: i + 1]) for i in range(len(parts)))
+    return sorted(names)
+
+
+async def refreshSources(sources):
+    """
+    Resolves the watched refs again once per round of the change detection, bypassing the ref cache and the shared
+    cache, and stores the results in both. Refs are revalidated with their etag, unchanged ones do not count against
+    the github rate limit.
+    """
+    await asyncio.gather(
+        *[
+            fetches.do(source, lambda source=source: fetchRef(*source[1:], fresh=True))
+            for source in sources
+            if source[0] == "ref"
+        ],
+        return_exceptions=True,
+    )
 
 
 @app.get("/{application}/{profile}/{label}")
@@ -38,6 +436,8 @@ async def endpoint_application_profile_label(
     label: str,
     prefix: Optional[str] = Header("default"),
     x_config_token: Optional[str] = Header(None),
+    request: Request = None,
+    response: Response = None,
 ):
     """
     The offered endpoint implements the basic feature of the spring cloud config server with an added label field. The label reflects in case of git/github the source of a ref/branch.
@@ -48,22 +448,21 @@ async def endpoint_application_profile_label(
     :param x_config_token: In case of the requirement to load values from vault, a header field is added to the http request which has access permissions to the secrets in vault.
     :return: The results contain an ordered set of source configurations from git and vault.
     """
-    results = await combine(
+    settings = configreader.getPrefixConfig(prefix)
+    combined = await combine(
         applications=[application, "application"],
         profiles=profile.split(","),
         labels=label.split(","),
         x_config_token=x_config_token,
-        github=configreader.getConfig()[prefix]["github"],
-        vault=configreader.getConfig()[prefix]["vault"],
+        github=settings["github"],
+        vault=settings["vault"],
+        settings=settings,
+        prefix=prefix,
     )
-    return {
-        "name": application,
-        "profiles": profile.split(","),
-        "label": label,
-        "version": None,
-        "state": None,
-        "propertySources": results,
-    }
+    tag = entityTag(combined, prefix, x_config_token, application, profile, label)
+    if notModified(request, tag):
+        return Response(status_code=304, headers=responseHeaders(combined, tag))
+    return environment(application, profile.split(","), label, combined, tag, response)
 
 
 @app.get("/{application}/{profile}")
@@ -72,23 +471,24 @@ async def endpoint_application_profile(
     profile: str,
     prefix: Optional[str] = Header("default"),
     x_config_token: Optional[str] = Header(None),
+    request: Request = None,
+    response: Response = None,
 ):
-    results = await combine(
+    settings = configreader.getPrefixConfig(prefix)
+    combined = await combine(
         applications=[application, "application"],
         profiles=profile.split(","),
         labels=["main"],
         x_config_token=x_config_token,
-        github=configreader.getConfig()[prefix]["github"],
-        vault=configreader.getConfig()[prefix]["vault"],
+        github=settings["github"],
+        vault=settings["vault"],
+        settings=settings,
+        prefix=prefix,
     )
-    return {
-        "name": application,
-        "profiles": profile.split(","),
-        "label": "main",
-        "version": None,
-        "state": None,
-        "propertySources": results,
-    }
+    tag = entityTag(combined, prefix, x_config_token, application, profile, "main")
+    if notModified(request, tag):
+        return Response(status_code=304, headers=responseHeaders(combined, tag))
+    return environment(application, profile.split(","), "main", combined, tag, response)
 
 
 @app.get("/{application}-{profile}.{fileending}")
@@ -98,40 +498,32 @@ async def endpoint_application_profile_fileending(
     fileending: str,
     prefix: Optional[str] = Header("default"),
     x_config_token: Optional[str] = Header(None),
+    request: Request = None,
+    response: Response = None,
 ):
-    results = await combine(
+    settings = configreader.getPrefixConfig(prefix)
+    combined = await combine(
         applications=[application, "application"],
         profiles=profile.split(","),
         labels=["main"],
         x_config_token=x_config_token,
-        github=configreader.getConfig()[prefix]["github"],
-        vault=configreader.getConfig()[prefix]["vault"],
+        github=settings["github"],
+        vault=settings["vault"],
+        settings=settings,
+        prefix=prefix,
     )
-    content = {
-        key: value for res in reversed(results) for key, value in res["source"].items()
-    }
-    if fileending == "properties":
-        c = [f"{key}={value}" for key, value in content.items()]
-        return Response(content="\n".join(c), media_type="application/text")
-    elif fileending == "yml" or fileending == "yaml":
+    tag = entityTag(
+        combined, prefix, x_config_token, application, profile, "main", fileending
+    )
+    if notModified(request, tag):
+        return Response(status_code=304, headers=responseHeaders(combined, tag))
+    if fileending in render.renderers:
         return Response(
-            content=yaml.dump(generateWideMap(content)), media_type="application/x-yaml"
+            content=render.render(combined["propertySources"], fileending, tag),
+            media_type=render.mediatypes[fileending],
+            headers=responseHeaders(combined, tag),
         )
-    elif fileending == "json":
-        c = {
-            key: value
-            for res in reversed(results)
-            for key, value in res["source"].items()
-        }
-        return c
-    return {
-        "name": application,
-        "profiles": profile.split(","),
-        "label": "main",
-        "version": None,
-        "state": None,
-        "propertySources": results,
-    }
+    return environment(application, profile.split(","), "main", combined, tag, response)
 
 
 @app.get("/{application}.{fileending}")
@@ -140,36 +532,203 @@ async def endpoint_application_fileending(
     fileending: str,
     prefix: Optional[str] = Header("default"),
     x_config_token: Optional[str] = Header(None),
+    request: Request = None,
+    response: Response = None,
 ):
-    results = await combine(
+    settings = configreader.getPrefixConfig(prefix)
+    combined = await combine(
         applications=[application, "application"],
         profiles=[],
         labels=["main"],
         x_config_token=x_config_token,
-        github=configreader.getConfig()[prefix]["github"],
-        vault=configreader.getConfig()[prefix]["vault"],
+        github=settings["github"],
+        vault=settings["vault"],
+        settings=settings,
+        prefix=prefix,
     )
+    tag = entityTag(combined, prefix, x_config_token, application, "", "main", "")
+    if notModified(request, tag):
+        return Response(status_code=304, headers=responseHeaders(combined, tag))
+    return environment(application, [], "main", combined, tag, response)
+
+
+class BatchItem(BaseModel):
+    application: str
+    profile: str = ""
+    label: str = "main"
+
+
+@app.post("/batch")
+async def endpoint_batch(
+    items: List[BatchItem],
+    prefix: Optional[str] = Header("default"),
+    x_config_token: Optional[str] = Header(None),
+):
+    """
+    Resolves the configuration of many applications at once. The search paths of all items are deduplicated, so
+    every file and secret is fetched once per batch.
+    :param items: The applications with their profiles and labels (comma separated, like the path endpoints).
+    :return: Newline delimited json, one spring cloud config environment per item in the order they complete.
+    """
+    settings = configreader.getPrefixConfig(prefix)
+
+    async def lines():
+        try:
+            async for application, profiles, label, combined in batch(
+                items, x_config_token, settings, prefix
+            ):
+                env = environment(application, profiles, label, combined)
+                yield json.dumps(env, default=str) + "\n"
+        except HTTPException as e:
+            # the status is already sent, a source with the fail policy ends the stream with an error line
+            yield json.dumps({"status": e.status_code, "error": e.detail}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+async def batch(items, x_config_token, settings, prefix="default"):
+    """
+    Fetches the union of the search paths of all items, vault once and every label group once, and yields
+    (application, profiles, label, combined) for each item as soon as its sources are available.
+    """
+    metrics.prefix.set(prefix)
+    github, vault = settings["github"], settings["vault"]
+    searches = []
+    groups = {}
+    for item in items:
+        profiles = item.profile.split(",") if item.profile else []
+        labels = item.label.split(",")
+        searchedFiles, searchedNames = generateSearchPaths(
+            [item.application, "application"],
+            profiles,
+            labels,
+            fileendings,
+            settings["searchpaths"],
+        )
+        observeSearchPaths(searchedFiles, searchedNames)
+        searches.append((item, profiles, labels, searchedFiles, searchedNames))
+        files = groups.setdefault(tuple(labels), {})
+        files.update(dict.fromkeys(searchedFiles))
+    vaultdegraded = []
+    vaulttask = None
+    if x_config_token:
+        names = dict.fromkeys(name for search in searches for name in search[4])
+        vaulttask = asyncio.ensure_future(
+            vaultSource(list(names), x_config_token, vault, settings, vaultdegraded)
+        )
+
+    async def fetchGroup(labels, files):
+        degraded = []
+        responses = await asyncio.gather(
+            *[gitSource(label, list(files), github, settings, degraded) for label in labels]
+        )
+        if vaulttask is not None:
+            responses = [await vaulttask] + responses
+        return labels, responses, degraded
+
+    pending = [
+        asyncio.ensure_future(fetchGroup(list(labels), files))
+        for labels, files in groups.items()
+    ]
+    try:
+        for done in asyncio.as_completed(pending):
+            labels, responses, degraded = await done
+            for item, profiles, itemlabels, searchedFiles, searchedNames in searches:
+                if itemlabels != labels:
+                    continue
+                combined = assemble(
+                    responses,
+                    searchedFiles,
+                    searchedNames,
+                    labels,
+                    x_config_token,
+                    github,
+                    settings,
+                    vaultdegraded + degraded,
+                    profiles,
+                )
+                yield item.application, profiles, item.label, combined
+    finally:
+        for task in pending + ([vaulttask] if vaulttask else []):
+            task.cancel()
+
+
+def entityTag(combined, prefix, x_config_token, *parts):
+    """
+    Builds a strong etag from the version of the combined sources and everything else that selects the response body.
+    Degraded responses and sources without a version get no etag.
+    """
+    if combined["version"] is None or combined["degraded"]:
+        return None
+    digest = hashlib.sha256(
+        "\0".join(
+            [
+                combined["version"],
+                prefix or "",
+                vaultclient.tokenHash(x_config_token) if x_config_token else "",
+                *parts,
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def notModified(request, tag):
+    if tag is None or request is None:
+        return False
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [value.strip() for value in header.split(",")]
+    return "*" in tags or tag in [value[2:] if value.startswith("W/") else value for value in tags]
+
+
+def responseHeaders(combined, tag=None):
+    headers = {}
+    if tag is not None:
+        headers["ETag"] = tag
+    if combined["degraded"]:
+        headers["X-Config-Degraded"] = ", ".join(combined["degraded"])
+    if combined.get("stale") is not None:
+        headers["X-Config-Stale"] = f"{combined['stale']:.0f}"
+    return headers
+
+
+def environment(application, profiles, label, combined, tag=None, response=None):
+    """
+    Builds the spring cloud config environment. Sources which failed under the partial policy are listed in the state
+    field and the X-Config-Degraded header, answers from a stale snapshot carry their age in seconds.
+    """
+    if response is not None:
+        response.headers.update(responseHeaders(combined, tag))
+    state = []
+    if combined["degraded"]:
+        state.append("degraded: " + ", ".join(combined["degraded"]))
+    if combined.get("stale") is not None:
+        state.append(f"stale: {combined['stale']:.0f}s")
     return {
         "name": application,
-        "profiles": [],
-        "label": "main",
-        "version": None,
-        "state": None,
-        "propertySources": results,
+        "profiles": profiles,
+        "label": label,
+        "version": combined["version"],
+        "state": "; ".join(state) or None,
+        "propertySources": combined["propertySources"],
     }
 
 
+class Sources(dict):
+    """
+    The property sources found by one backend lookup, keyed by their name. version identifies the state they were
+    read at (commit sha for git, a digest of the secret versions for vault).
+    """
+
+    def __init__(self, sources=None, version=None):
+        super().__init__(sources or {})
+        self.version = version
+
+
 def flatten(d, parent_key="", sep="."):
-    if not d:
-        return {}
-    items = []
-    for k, v in d.items():
-        new_key = parent_key + sep + k if parent_key else k
-        if isinstance(v, MutableMapping):
-            items.extend(flatten(v, new_key, sep=sep).items())
-        else:
-            items.append((new_key, v))
-    return dict(items)
+    return parsers.flatten(d, parent_key, sep)
 
 
 def merge(prio, weak):
@@ -179,45 +738,452 @@ def merge(prio, weak):
     return prio
 
 
+def parseFile(path, content):
+    with metrics.parseTime.time(
+        timing="parse",
+        prefix=metrics.prefix.get(),
+        format=parsers.kind(path),
+    ):
+        documents = parsers.parse(path, content)
+    if len(documents) == 1 and documents[0][0] is None:
+        # plain files stay the flat map they always were, only multi-document files need the profiles
+        return documents[0][1]
+    return documents
+
+
+async def sharedLookup(key, fetch, ttl=None):
+    if shared is None:
+        return await fetch()
+    return await shared.lookup(key, fetch, ttl)
+
+
+async def resolveRef(repository, label):
+    """
+    Resolves label to its commit sha. While the github budget is low refs are re-checked less often, once github
+    rate limits us the last known sha is served instead of failing.
+    """
+    sha = refcache.get((repository, label))
+    if sha is None:
+        sha = await fetches.do(
+            ("ref", repository, label), lambda: fetchRef(repository, label)
+        )
+    return sha
+
+
+async def fetchRef(repository, label, fresh=False):
+    """
+    Resolves label through the shared cache, or with fresh straight from github, updating the shared entry.
+    """
+    ratelimitsettings = configreader.getRateLimitSettings()
+    ttl = refcache.ttl
+    if githubclient.budgetLow(ratelimitsettings["reserve"]):
+        ttl = max(ttl, ratelimitsettings["refttl"])
+    key = f"ref:{repository}:{label}"
+    try:
+        if fresh:
+            sha = await githubclient.resolveRef(repository, label)
+            if shared is not None:
+                await asyncio.to_thread(shared.put, key, sha, ttl)
+        else:
+            sha = await sharedLookup(
+                key, lambda: githubclient.resolveRef(repository, label), ttl=ttl
+            )
+    except githubclient.RateLimited as e:
+        sha = knownrefs.get((repository, label))
+        if sha is None:
+            raise
+        logger.warning(f"github: {e}, serving the last known sha of {label}")
+    knownrefs.put((repository, label), sha)
+    return refcache.put((repository, label), sha, ttl)
+
+
+async def treeIndex(repository, sha, local=None):
+    """
+    Returns {path: blob sha} of every file of a commit, from the local mirror if one is given and from github
+    otherwise. The tree is fetched once per commit, lookups are dict lookups.
+    """
+    index = listingcache.get((repository, sha))
+    if index is None:
+
+        async def fetch():
+            if local:
+                return dict(await local.listTree(sha))
+            return dict(await githubclient.listTree(repository, sha))
+
+        async def lookup():
+            return listingcache.put(
+                (repository, sha),
+                await sharedLookup(f"tree:{repository}:{sha}", fetch),
+            )
+
+        index = await fetches.do(("tree", repository, sha), lookup)
+    return index
+
+
+async def getSource(repository, path, blobsha, local=None):
+    """
+    Returns the parsed file with blobsha. Blobs are content addressed, identical files are fetched and parsed once
+    no matter which repository, prefix or path they are found under (as long as they are parsed the same way).
+    """
+    key = (blobsha, parsers.kind(path))
+    source = sourcecache.get(key)
+    if source is None:
+
+        async def fetch():
+            if local:
+                content = await local.getBlob(blobsha)
+            else:
+                content = await githubclient.getBlob(repository, blobsha)
+            metrics.fetchedBytes.inc(
+                len(content),
+                prefix=metrics.prefix.get(),
+                source="mirror" if local else "github",
+            )
+            return parseFile(path, content)
+
+        async def lookup():
+            return sourcecache.put(
+                key, await sharedLookup(f"source:{key[1]}:{blobsha}", fetch)
+            )
+
+        source = await fetches.do(("source", *key), lookup)
+    return source
+
+
+async def getFromIndex(repository, sha, searchedFiles, local=None):
+    index = await treeIndex(repository, sha, local)
+    matches = [
+        (path, index[path]) for path in dict.fromkeys(searchedFiles) if path in index
+    ]
+    sources = await asyncio.gather(
+        *[getSource(repository, path, blobsha, local) for path, blobsha in matches]
+    )
+    results = Sources(version=sha)
+    for (path, _), source in zip(matches, sources):
+        results[f"https://github.com/{repository}/{path}"] = source
+    return results
+
+
 async def getFromGithub(label, searchedFiles, repository=configreader.default_repo):
-    results = {}
     try:
-        repo = g.get_repo(repository)
-        contents = repo.get_contents(path="", ref=label)
-        for content in contents:
-            if content.path in searchedFiles:
-                if ".yaml" in content.path or ".yml" in content.path:
-                    results[
-                        f"https://github.com/{repository}/{content.path}"
-                    ] = flatten(yaml.safe_load(content.decoded_content))
+        sha = await resolveRef(repository, label)
+        return await getFromIndex(repository, sha, searchedFiles)
+    except githubclient.NotFound:
+        logger.info(f"ref: {label} not found")
+    return Sources()
+
+
+def mirrorFor(repository, mirror=None):
+    mirror = mirror or {}
+    return gitmirror.getMirror(
+        mirror.get("url") or f"https://github.com/{repository}.git",
+        mirror.get("path", "mirrors"),
+        mirror.get("interval", 60),
+    )
+
+
+async def getFromMirror(
+    label, searchedFiles, repository=configreader.default_repo, mirror=None
+):
+    """
+    Answers the same lookups as getFromGithub from a local mirror clone. Blob shas are the same as on github, so
+    parsed files are shared with the github backend through the sourcecache.
+    """
+    local = mirrorFor(repository, mirror)
+    await local.ensure()
+    sha = await local.resolveRef(label)
+    if sha is None:
+        logger.info(f"ref: {label} not found")
+        return Sources()
+    return await getFromIndex(repository, sha, searchedFiles, local)
+
+
+def isPathSegment(value):
+    """
+    Whether a value from the url can name a single file or subdirectory: not "." or ".." and without path separators.
+    """
+    return value not in (".", "..") and "/" not in value and os.sep not in value and "\0" not in value
+
+
+def nativePath(native, label):
+    """
+    The directory of label. Labels from the url may not leave the configured directory: ".", ".." and labels with
+    path separators are rejected.
+    """
+    path = native["path"]
+    if "{label}" not in path:
+        return path
+    if not isPathSegment(label):
+        raise HTTPException(status_code=400, detail=f"invalid label {label}")
+    base = os.path.abspath(path.split("{label}", 1)[0] or ".")
+    resolved = os.path.abspath(path.replace("{label}", label))
+    if os.path.commonpath([base, resolved]) != base:
+        raise HTTPException(status_code=400, detail=f"invalid label {label}")
+    return resolved
+
+
+async def getFromNative(label, searchedFiles, native=None):
+    """
+    Serves the searched files from a local directory. native.path may contain {label} to map labels to
+    subdirectories, otherwise the label is ignored.
+    """
+    native = native or configreader.prefixdefaults["native"]
+    directory = nativesource.getDirectory(
+        nativePath(native, label), native.get("interval", 0)
+    )
+    found, version = directory.lookup(
+        searchedFiles,
+        parseFile,
+        lambda name, content: metrics.fetchedBytes.inc(
+            len(content), prefix=metrics.prefix.get(), source="native"
+        ),
+    )
+    return Sources(
+        {f"file:{os.path.join(directory.path, name)}": source for name, source in found.items()},
+        version=version,
+    )
+
+
+def fileSourceName(settings, repository, path, label="main"):
+    """
+    The name of the property source of a configuration file, as used by the backend of the prefix.
+    """
+    if settings["source"] == "native":
+        directory = nativesource.getDirectory(
+            nativePath(settings["native"], label), settings["native"].get("interval", 0)
+        )
+        return f"file:{os.path.join(directory.path, path)}"
+    return f"https://github.com/{repository}/{path}"
+
+
+def searchPathPattern(searchpath):
+    """
+    A regular expression matching the directories a search path can expand to, placeholders match any directory.
+    """
+    return re.compile(
+        "[^/]+".join(
+            re.escape(part)
+            for part in re.split(r"\{(?:application|profile|label)\}", searchpath.strip("/"))
+        )
+    )
+
+
+def isConfigFile(path, searchpaths=()):
+    directory, _, name = path.rpartition("/")
+    if name.rsplit(".", 1)[-1] not in fileendings:
+        return False
+    return not directory or any(
+        searchPathPattern(searchpath).fullmatch(directory) for searchpath in searchpaths
+    )
+
+
+async def prefetch(settings, label):
+    """
+    Resolves label and parses every configuration file in the root and the search paths of the prefix's repository
+    (or directory) into the caches. Returns the number of files.
+    """
+    searchpaths = settings["searchpaths"]
+    if settings["source"] == "native":
+        directory = nativesource.getDirectory(
+            nativePath(settings["native"], label), settings["native"].get("interval", 0)
+        )
+        names = [
+            os.path.relpath(os.path.join(root, name), directory.path).replace(os.sep, "/")
+            for root, _, files in os.walk(directory.path)
+            for name in files
+        ]
+        names = [name for name in names if isConfigFile(name, searchpaths)]
+        directory.lookup(names, parseFile)
+        return len(names)
+    repository = settings["github"]
+    local = None
+    if settings["source"] == "mirror":
+        local = mirrorFor(repository, settings["mirror"])
+        await local.ensure()
+        sha = await local.resolveRef(label)
+        if sha is None:
+            raise gitmirror.GitError(f"ref: {label} not found")
+    else:
+        sha = await resolveRef(repository, label)
+    files = [
+        (path, blobsha)
+        for path, blobsha in (await treeIndex(repository, sha, local)).items()
+        if isConfigFile(path, searchpaths)
+    ]
+    await asyncio.gather(
+        *[getSource(repository, path, blobsha, local) for path, blobsha in files]
+    )
+    return len(files)
+
+
+async def warmup():
+    """
+    Prefetches the configured labels of every prefix. Prefixes sharing a repository (or directory) are fetched once.
+    The server reports ready on /ready once this is done, failures are logged and do not block readiness.
+    """
+    warmupsettings = configreader.getWarmupSettings()
+    if warmupsettings["enabled"]:
+        jobs = {}
+        for prefix in configreader.getConfig():
+            settings = configreader.getPrefixConfig(prefix)
+            for label in warmupsettings["labels"]:
+                if settings["source"] == "native":
+                    if not isPathSegment(label):
+                        logger.warning(f"warmup: {prefix}: invalid label {label}")
+                        continue
+                    key = ("native", nativePath(settings["native"], label))
                 else:
-                    results[f"https://github.com/{repository}/{content.path}"] = {
-                        line[0 : line.find("=")]: line[line.find("=") + 1 :]
-                        for line in content.decoded_content.decode("utf-8")
-                        .strip()
-                        .split("\n")
-                    }
-    except github.GithubException:
-        print(f"ref: {label} not found")
-    return results
+                    key = (settings["source"], settings["github"], label)
+                jobs.setdefault(key, (prefix, settings, label))
+
+        async def warm(prefix, settings, label):
+            metrics.prefix.set(prefix)
+            start = time.perf_counter()
+            count = await prefetch(settings, label)
+            logger.info(
+                f"warmup: {prefix} {label} prefetched {count} files in {time.perf_counter() - start:.2f}s"
+            )
+
+        results = await asyncio.gather(
+            *[warm(*job) for job in jobs.values()], return_exceptions=True
+        )
+        for (prefix, _, label), result in zip(jobs.values(), results):
+            if isinstance(result, Exception):
+                logger.warning(f"warmup: {prefix} {label} failed: {result}")
+    warmupstate["done"] = True
+
+
+def startWarmup():
+    warmupstate["done"] = False
+    warmupstate["task"] = asyncio.ensure_future(warmup())
 
 
-async def getFromVault(searchedNames, secretpath="secret", vaulttoken="token"):
-    vault = hvac.Client(
-        url=configreader.getVaultAddress(),
-        token=vaulttoken if vaulttoken else os.environ["VAULT_TOKEN"],
-        verify=False,
+app.add_event_handler("startup", startWarmup)
+
+
+async def getFromVault(
+    searchedNames, secretpath="secret", vaulttoken="token", vaultcache=None
+):
+    token = vaulttoken if vaulttoken else os.environ["VAULT_TOKEN"]
+    address = configreader.getVaultAddress()
+    names = list(dict.fromkeys(searchedNames))
+    secrets = await asyncio.gather(
+        *[readSecret(address, token, secretpath, name, vaultcache) for name in names]
+    )
+    found = [(name, secret) for name, secret in zip(names, secrets) if secret is not None]
+    if not found:
+        # every read was denied or missing: a rejected token must not look like a configuration without secrets
+        await fetches.do(
+            ("token", address, vaultclient.tokenHash(token)),
+            lambda: vaultclient.checkToken(address, token),
+        )
+    return Sources(
+        {
+            f"vault:{name}": secretSource(address, secretpath, name, secret)
+            for name, secret in found
+        },
+        version=hashlib.sha256(
+            ",".join(
+                f"{name}@{secret['data']['metadata']['version']}"
+                for name, secret in found
+            ).encode("utf-8")
+        ).hexdigest()[:16],
     )
-    results = {}
-    for searchedName in searchedNames:
+
+
+def readSecret(address, token, mount, name, vaultcache=None):
+    """
+    Reads a secret, concurrent reads of the same secret with the same token share one call to vault.
+    """
+    cached = bool(vaultcache and vaultcache["enabled"])
+    if cached:
+        read = lambda: vaultclient.readCachedSecret(
+            address, token, mount, name, vaultcache["ttl"]
+        )
+    else:
+        read = lambda: vaultclient.readSecret(address, token, mount, name)
+    return fetches.do(
+        ("secret", address, vaultclient.tokenHash(token), mount, name, cached), read
+    )
+
+
+def secretSource(address, mount, name, secret):
+    """
+    The flattened data of a secret, shared by every token that may read the same version of it.
+    """
+    key = (address, mount, name, secret["data"]["metadata"]["version"])
+    source = secretsources.get(key)
+    if source is None:
+        source = secretsources.put(
+            key, parsers.Properties(flatten(secret["data"]["data"]))
+        )
+    return source
+
+
+async def fetchSource(
+    name, task, timeout, policy, degraded, kind="github", breaker=None
+):
+    """
+    Awaits a single source. Depending on the policy of the source a failure or timeout either fails the whole request
+    ("fail") or is recorded in degraded and answered with an empty result ("partial"). Failures count against the
+    circuit breaker of the backend, while it is open the backend is not asked at all.
+    """
+    try:
+        if breaker is not None:
+            breaker.check()
         try:
-            secret = vault.secrets.kv.read_secret_version(
-                path=searchedName, mount_point=secretpath
-            )
-            results[f"vault:{searchedName}"] = flatten(secret["data"]["data"])
-        except:
-            pass
-    return results
+            with metrics.backendLatency.time(
+                timing=kind, prefix=metrics.prefix.get(), source=kind
+            ):
+                result = await asyncio.wait_for(task, timeout=timeout)
+        except hvac.exceptions.Forbidden:
+            # the backend answered, it rejected the client's token
+            if breaker is not None:
+                breaker.success()
+            raise
+        except Exception:
+            # every failure counts, unexpected ones as well
+            if breaker is not None:
+                breaker.failure()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            breaker.success()
+        return result
+    except circuitbreaker.Open as e:
+        if asyncio.isfuture(task):
+            task.cancel()
+        else:
+            task.close()
+        logger.warning(f"source: {e}")
+        if policy == "fail":
+            raise HTTPException(status_code=503, detail=f"{name} unavailable")
+    except asyncio.TimeoutError:
+        metrics.backendErrors.inc(prefix=metrics.prefix.get(), source=kind)
+        logger.warning(f"source: {name} timed out after {timeout}s")
+        if policy == "fail":
+            raise HTTPException(status_code=504, detail=f"{name} timed out")
+    except (
+        githubclient.GithubError,
+        gitmirror.GitError,
+        httpx.HTTPError,
+        hvac.exceptions.VaultError,
+        requests.RequestException,
+    ) as e:
+        metrics.backendErrors.inc(prefix=metrics.prefix.get(), source=kind)
+        logger.warning(f"source: {name} failed: {e}")
+        if policy == "fail":
+            raise HTTPException(status_code=502, detail=f"{name} failed")
+    degraded.append(name)
+    return {}
+
+
+def breakerFor(name):
+    settings = configreader.getCircuitBreakerSettings()
+    return circuitbreaker.getBreaker(name, settings["threshold"], settings["cooldown"])
 
 
 async def combine(
@@ -227,67 +1193,284 @@ async def combine(
     x_config_token,
     github="joe255/testconfig-repo",
     vault="secret",
+    settings=None,
+    prefix="default",
+    allowstale=True,
+):
+    """
+    Collects the property sources of all backends. Concurrent identical requests are coalesced into a single fetch,
+    the token fingerprint is part of the key so results are never shared between different tokens. Prefixes with the
+    same settings share fetches and snapshots.
+    """
+    settings = settings or configreader.getPrefixConfig(prefix)
+    metrics.prefix.set(prefix)
+    key = combineKey(
+        settings, github, vault, applications, profiles, labels, x_config_token
+    )
+
+    def fetch():
+        return inflight.do(
+            key,
+            lambda: combineSources(
+                applications, profiles, labels, x_config_token, github, vault, settings
+            ),
+        )
+
+    if allowstale and settings["stale"]["enabled"]:
+        return await staleWhileRevalidate(key, fetch, settings["stale"])
+    return await fetch()
+
+
+def combineKey(settings, github, vault, applications, profiles, labels, x_config_token):
+    return (
+        settingsKey(settings),
+        github,
+        vault,
+        tuple(applications),
+        tuple(profiles),
+        tuple(labels),
+        vaultclient.tokenHash(x_config_token) if x_config_token else None,
+    )
+
+
+def settingsKey(settings):
+    """
+    Identifies the sources a prefix reads and how: prefixes pointing to the same repository and vault mount with the
+    same settings get the same (interned) key.
+    """
+    return sys.intern(json.dumps(settings, sort_keys=True, default=str))
+
+
+async def staleWhileRevalidate(key, fetch, stale):
+    """
+    Answers from the last complete snapshot of key: younger than stale.fresh seconds as it is, up to stale.maxage
+    marked stale while a background fetch refreshes it. Without a usable snapshot the request waits for the fetch.
+    """
+    snapshot = snapshots.get(key)
+    if snapshot is not None:
+        age = time.monotonic() - snapshot[0]
+        if age < stale["fresh"]:
+            return snapshot[1]
+        if age < stale["maxage"]:
+            revalidate(key, fetch)
+            metrics.staleResponses.inc(prefix=metrics.prefix.get())
+            return {**snapshot[1], "stale": age}
+    return keepSnapshot(key, await fetch())
+
+
+def keepSnapshot(key, combined):
+    if not combined["degraded"]:
+        snapshots.put(key, (time.monotonic(), combined))
+    return combined
+
+
+def revalidate(key, fetch):
+    if key in refreshing:
+        return
+
+    def done(task):
+        refreshing.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning(f"stale: refreshing {key[3]} failed: {task.exception()}")
+            return
+        keepSnapshot(key, task.result())
+
+    refreshing[key] = asyncio.ensure_future(fetch())
+    refreshing[key].add_done_callback(done)
+
+
+def vaultSource(searchedNames, x_config_token, vault, settings, degraded):
+    return fetchSource(
+        "vault",
+        getFromVault(
+            searchedNames=searchedNames,
+            vaulttoken=x_config_token,
+            secretpath=vault,
+            vaultcache=settings["vaultcache"],
+        ),
+        settings["timeout"]["vault"],
+        settings["policy"]["vault"],
+        degraded,
+        kind="vault",
+        breaker=breakerFor(f"vault:{configreader.getVaultAddress()}"),
+    )
+
+
+def gitSource(label, searchedFiles, github, settings, degraded):
+    breaker = None
+    if settings["source"] == "native":
+        source = getFromNative(
+            label=label, searchedFiles=searchedFiles, native=settings["native"]
+        )
+    elif settings["source"] == "mirror":
+        breaker = breakerFor(f"mirror:{mirrorFor(github, settings['mirror']).url}")
+        source = getFromMirror(
+            label=label,
+            searchedFiles=searchedFiles,
+            repository=github,
+            mirror=settings["mirror"],
+        )
+    else:
+        breaker = breakerFor(f"github:{github}")
+        source = getFromGithub(
+            label=label, searchedFiles=searchedFiles, repository=github
+        )
+    return fetchSource(
+        f"github:{label}",
+        source,
+        settings["timeout"]["github"],
+        settings["policy"]["github"],
+        degraded,
+        kind=settings["source"],
+        breaker=breaker,
+    )
+
+
+def observeSearchPaths(searchedFiles, searchedNames):
+    metrics.searchPaths.observe(
+        len(searchedFiles), prefix=metrics.prefix.get(), kind="files"
+    )
+    metrics.searchPaths.observe(
+        len(searchedNames), prefix=metrics.prefix.get(), kind="names"
+    )
+
+
+async def combineSources(
+    applications, profiles, labels, x_config_token, github, vault, settings
 ):
-    results = []
     tasks = []
+    degraded = []
     searchedFiles, searchedNames = generateSearchPaths(
-        applications, profiles, labels, fileendings
+        applications, profiles, labels, fileendings, settings["searchpaths"]
     )
+    observeSearchPaths(searchedFiles, searchedNames)
     if x_config_token:
         tasks.append(
-            getFromVault(
-                searchedNames=searchedNames, vaulttoken=x_config_token, secretpath=vault
-            )
+            vaultSource(searchedNames, x_config_token, vault, settings, degraded)
         )
     for label in labels:
-        tasks.append(
-            getFromGithub(label=label, searchedFiles=searchedFiles, repository=github)
-        )
+        tasks.append(gitSource(label, searchedFiles, github, settings, degraded))
+    responses = await asyncio.gather(*tasks)
+    return assemble(
+        responses,
+        searchedFiles,
+        searchedNames,
+        labels,
+        x_config_token,
+        github,
+        settings,
+        degraded,
+        profiles,
+    )
+
+
+def documentSources(name, source, profiles):
+    """
+    Returns the property sources of one file: multi-document yaml files contribute every document active for the
+    profiles (later documents first), named like spring cloud config does.
+    """
+    if not isinstance(source, parsers.Documents):
+        return [{"name": name, "source": source}]
+    active = [profile for profile in profiles if profile]
+    return [
+        {"name": f"{name} (document #{i})", "source": properties}
+        for i, properties in source.select(active)
+        if properties
+    ]
+
+
+def assemble(
+    responses,
+    searchedFiles,
+    searchedNames,
+    labels,
+    x_config_token,
+    github,
+    settings,
+    degraded,
+    profiles=(),
+):
+    """
+    Orders the backend responses (vault first if a token is given, then one per label) by the search paths: vault
+    secrets before files, more specific names first.
+    """
+    results = []
     tempres = {}
-    for task in tasks:
-        res = await task
+    versions = [getattr(res, "version", None) for res in responses]
+    for res in responses:
         for key in res:
             if res[key]:
-                tempres[key] = {"name": key, "source": res[key]}
+                tempres[key] = documentSources(key, res[key], profiles)
                 # results.append({'name': key, 'source': res[key]})
     for sn in searchedNames:
         if f"vault:{sn}" in tempres:
-            results.append(tempres[f"vault:{sn}"])
-    for sn in searchedFiles:
-        if f"https://github.com/{github}/{sn}" in tempres:
-            results.append(tempres[f"https://github.com/{github}/{sn}"])
-    return results
+            results.extend(tempres[f"vault:{sn}"])
+    # generateSearchPaths repeats the same block of files for every label
+    perlabel = len(searchedFiles) // len(labels) if labels else 0
+    added = set()
+    for i, sn in enumerate(searchedFiles):
+        name = fileSourceName(settings, github, sn, labels[i // perlabel])
+        if name in tempres and name not in added:
+            added.add(name)
+            results.extend(tempres[name])
+    version = None
+    if None not in versions:
+        version = ",".join(versions[1:] if x_config_token else versions)
+        if x_config_token:
+            version += f";vault:{versions[0]}"
+    return {"propertySources": results, "degraded": degraded, "version": version}
 
 
-def generateSearchPaths(applications, profiles, labels, fileendings):
+def searchDirectories(searchpaths, applications, profiles, label):
+    """
+    Expands the search paths of a prefix for one request: {application}, {profile} and {label} are replaced by every
+    requested value. The repository root is always searched first.
+    """
+    values = {
+        "{application}": [a for a in applications if a != "application"] or applications,
+        "{profile}": [profile for profile in profiles if profile],
+        # labels are git refs and may contain slashes, those are not expanded
+        "{label}": [label] if isPathSegment(label) else [],
+    }
+    directories = [""]
+    for searchpath in searchpaths:
+        expanded = [searchpath]
+        for placeholder, replacements in values.items():
+            if placeholder in searchpath:
+                expanded = [
+                    path.replace(placeholder, value)
+                    for path in expanded
+                    for value in replacements
+                ]
+        directories.extend(f"{path.strip('/')}/" for path in expanded if path.strip("/"))
+    return directories
+
+
+def generateSearchPaths(applications, profiles, labels, fileendings, searchpaths=()):
+    for value in [*applications, *profiles]:
+        if not isPathSegment(value):
+            raise HTTPException(status_code=400, detail=f"invalid application or profile {value}")
     searchedFiles = []
     searchedNames = []
     for label in labels:
+        directories = searchDirectories(searchpaths, applications, profiles, label)
         for application in applications:
             for profile in profiles:
                 for fileending in fileendings:
-                    searchedFiles.append(
-                        f'{application}{"-" + profile if profile else ""}.{fileending}'
+                    searchedFiles.extend(
+                        f'{directory}{application}{"-" + profile if profile else ""}.{fileending}'
+                        for directory in directories
                     )
                 searchedNames.append(f'{application}{"," + profile if profile else ""}')
         for application in applications:
             for fileending in fileendings:
-                searchedFiles.append(f"{application}.{fileending}")
+                searchedFiles.extend(
+                    f"{directory}{application}.{fileending}" for directory in directories
+                )
             searchedNames.append(f"{application}")
     return searchedFiles, searchedNames
 
 
 # asyncio.run(combine())
-
-
-def generateWideMap(map, sep="."):
-    rval = {}
-    for key, value in map.items():
-        trval = rval
-        for item in key.split(sep):
-            if not item in trval and item == key.split(sep)[-1]:
-                trval[item] = value
-            elif not item in trval:
-                trval[item] = {}
-            trval = trval[item]
-    return rval
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+import weakref
+
+import httpx
+
+import cache
+
+apiurl = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+githubtoken = os.environ.get("GITHUB_TOKEN", "")
+limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+timeout = httpx.Timeout(10.0)
+clients = weakref.WeakKeyDictionary()
+# the budget github reported last; once it is spent requests are held back locally until "blocked"
+ratelimit = {
+    "limit": None,
+    "remaining": None,
+    "reset": None,
+    "blocked": 0.0,
+    "notmodified": 0,
+    "throttled": 0,
+}
+# (path, params, accept) -> (etag, response) of conditional requests, answers to them with 304 are free
+etags = cache.LRUCache(maxsize=1024)
+
+
+class GithubError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class NotFound(GithubError):
+    pass
+
+
+class RateLimited(GithubError):
+    pass
+
+
+def getClient():
+    """
+    Returns the pooled client of the running event loop. httpx clients can not be shared between loops, so every loop
+    (one per uvicorn worker) gets its own keep-alive pool.
+    """
+    loop = asyncio.get_running_loop()
+    client = clients.get(loop)
+    if client is None or client.is_closed:
+        headers = {"Accept": "application/vnd.github.v3+json"}
+        if githubtoken:
+            headers["Authorization"] = f"token {githubtoken}"
+        client = httpx.AsyncClient(
+            base_url=apiurl, headers=headers, limits=limits, timeout=timeout
+        )
+        clients[loop] = client
+    return client
+
+
+async def close():
+    client = clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def track(response):
+    """
+    Records the rate limit headers of a response. Throttled responses (403/429 with the budget spent or a
+    Retry-After) block further requests until github allows them again.
+    """
+    headers = response.headers
+    remaining = headers.get("X-RateLimit-Remaining")
+    reset = headers.get("X-RateLimit-Reset")
+    if remaining is not None and remaining.isdigit() and reset is not None and reset.isdigit():
+        # concurrent responses arrive out of order, within one window the budget only goes down
+        if int(reset) != ratelimit["reset"] or ratelimit["remaining"] is None:
+            ratelimit["remaining"] = int(remaining)
+        else:
+            ratelimit["remaining"] = min(ratelimit["remaining"], int(remaining))
+        ratelimit["reset"] = int(reset)
+        ratelimit["limit"] = int(headers.get("X-RateLimit-Limit", "0") or 0) or ratelimit["limit"]
+    if response.status_code == 429 or (
+        response.status_code == 403
+        and (headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers)
+    ):
+        retryafter = headers.get("Retry-After")
+        if retryafter is not None and retryafter.isdigit():
+            ratelimit["blocked"] = time.time() + int(retryafter)
+        elif ratelimit["reset"]:
+            ratelimit["blocked"] = float(ratelimit["reset"])
+        else:
+            ratelimit["blocked"] = time.time() + 60
+        ratelimit["throttled"] += 1
+        raise RateLimited(response.status_code, response.text)
+
+
+def budgetLow(reserve):
+    """
+    True if less than reserve requests are left until the rate limit resets.
+    """
+    return (
+        ratelimit["remaining"] is not None
+        and ratelimit["remaining"] < reserve
+        and (ratelimit["reset"] or 0) > time.time()
+    )
+
+
+async def get(path, params=None, accept=None, conditional=False):
+    """
+    Sends a GET to the api. Conditional requests revalidate the last response with its ETag and return it again if
+    github answers 304.
+    """
+    if ratelimit["blocked"] > time.time():
+        raise RateLimited(
+            403, f"rate limited for {ratelimit['blocked'] - time.time():.0f}s"
+        )
+    headers = {"Accept": accept} if accept else {}
+    key = (path, tuple(sorted((params or {}).items())), accept)
+    stored = etags.get(key) if conditional else None
+    if stored is not None:
+        headers["If-None-Match"] = stored[0]
+    response = await getClient().get(path, params=params, headers=headers or None)
+    track(response)
+    if response.status_code == 304 and stored is not None:
+        ratelimit["notmodified"] += 1
+        return stored[1]
+    if response.status_code == 404 or response.status_code == 422:
+        raise NotFound(response.status_code, path)
+    if response.status_code >= 400:
+        raise GithubError(response.status_code, response.text)
+    if conditional and "ETag" in response.headers:
+        etags.put(key, (response.headers["ETag"], response))
+    return response
+
+
+async def resolveRef(repository, ref):
+    """
+    Resolves a branch, tag or sha to the sha of its commit.
+    """
+    response = await get(
+        f"/repos/{repository}/commits/{ref}",
+        accept="application/vnd.github.sha",
+        conditional=True,
+    )
+    return response.text.strip()
+
+
+async def listTree(repository, sha):
+    """
+    Lists (path, blob sha) of every file in the tree of a commit with one recursive request. Trees too large for a
+    single response (github truncates them) are walked directory by directory instead.
+    """
+    response = await get(
+        f"/repos/{repository}/git/trees/{sha}", params={"recursive": "1"}
+    )
+    tree = response.json()
+    if not tree.get("truncated"):
+        return [
+            (entry["path"], entry["sha"])
+            for entry in tree["tree"]
+            if entry["type"] == "blob"
+        ]
+    return await walkTree(repository, sha)
+
+
+async def walkTree(repository, sha, path=""):
+    response = await get(f"/repos/{repository}/git/trees/{sha}")
+    files = []
+    subtrees = []
+    for entry in response.json()["tree"]:
+        if entry["type"] == "blob":
+            files.append((f"{path}{entry['path']}", entry["sha"]))
+        elif entry["type"] == "tree":
+            subtrees.append(walkTree(repository, entry["sha"], f"{path}{entry['path']}/"))
+    for subtree in await asyncio.gather(*subtrees):
+        files.extend(subtree)
+    return files
+
+
+async def getBlob(repository, blobsha):
+    response = await get(
+        f"/repos/{repository}/git/blobs/{blobsha}", accept="application/vnd.github.raw"
+    )
+    return response.content
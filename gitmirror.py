@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+import githubclient
+
+logger = logging.getLogger("configserver")
+
+
+class GitError(Exception):
+    pass
+
+
+class Mirror:
+    """
+    A bare mirror clone of a repository on local disk. Refs are resolved and blobs are read straight from the local
+    object store, a background task fetches from the remote every interval seconds.
+    """
+
+    def __init__(self, url, path, interval=60):
+        self.url = url
+        self.path = path
+        self.interval = interval
+        self.refs = {}
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.cloning = None
+
+    async def git(self, *args, gitdir=True):
+        """
+        Runs git on the mirror. The token is handed over in the environment, not on the command line where every
+        local user could read it, and the process is killed if the caller is cancelled (e.g. by a timeout).
+        """
+        env = None
+        if githubtoken() and self.url.startswith("https://github.com/"):
+            credentials = base64.b64encode(
+                f"x-access-token:{githubtoken()}".encode("utf-8")
+            ).decode("utf-8")
+            env = {
+                **os.environ,
+                "GIT_CONFIG_COUNT": "1",
+                "GIT_CONFIG_KEY_0": "http.extraHeader",
+                "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+            }
+        process = await asyncio.create_subprocess_exec(
+            "git",
+            *(["--git-dir", self.path] if gitdir else []),
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        try:
+            stdout, stderr = await process.communicate()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        if process.returncode != 0:
+            raise GitError(stderr.decode("utf-8", "replace").strip())
+        return stdout
+
+    @property
+    def cloned(self):
+        return os.path.isdir(self.path)
+
+    async def clone(self):
+        async with self.lock:
+            if not self.cloned:
+                # clone next to the mirror and move it in place once complete, an interrupted clone leaves no
+                # half-cloned mirror behind
+                temporary = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+                try:
+                    await self.git(
+                        "clone", "--mirror", "--quiet", self.url, temporary, gitdir=False
+                    )
+                    os.rename(temporary, self.path)
+                finally:
+                    shutil.rmtree(temporary, ignore_errors=True)
+
+    def cloneDone(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"mirror: cloning {self.url} failed: {task.exception()}")
+
+    async def ensure(self):
+        """
+        Waits until the mirror is cloned and starts fetching it in the background. The first clone runs in a task of
+        its own: callers giving up (e.g. a request timing out) do not interrupt it, later callers wait for the same
+        clone. A failed clone is tried again by the next caller.
+        """
+        if not self.cloned:
+            if self.cloning is None or self.cloning.done():
+                self.cloning = asyncio.ensure_future(self.clone())
+                self.cloning.add_done_callback(self.cloneDone)
+            await asyncio.shield(self.cloning)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def fetch(self):
+        async with self.lock:
+            await self.git("fetch", "--prune", "--quiet", "origin")
+            self.refs = {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.fetch()
+            except GitError as e:
+                logger.warning(f"mirror: fetching {self.url} failed: {e}")
+
+    async def resolveRef(self, ref):
+        """
+        Resolves a branch, tag or sha to the sha of its commit. Results are kept until the next fetch, None is
+        returned for unknown refs.
+        """
+        if ref not in self.refs:
+            if not self.cloned:
+                raise GitError(f"{self.url} is not cloned yet")
+            try:
+                sha = await self.git(
+                    "rev-parse", "--verify", "--quiet", "--end-of-options", f"{ref}^{{commit}}"
+                )
+                self.refs[ref] = sha.decode("utf-8").strip()
+            except GitError:
+                self.refs[ref] = None
+        return self.refs[ref]
+
+    async def listTree(self, sha):
+        """
+        Lists (path, blob sha) of every file in the tree of a commit.
+        """
+        listing = await self.git("ls-tree", "-r", "-z", sha)
+        files = []
+        for entry in listing.decode("utf-8").split("\0"):
+            if not entry:
+                continue
+            info, name = entry.split("\t", 1)
+            _, kind, blobsha = info.split(" ")
+            if kind == "blob":
+                files.append((name, blobsha))
+        return files
+
+    async def getBlob(self, blobsha):
+        return await self.git("cat-file", "blob", blobsha)
+
+    async def close(self):
+        if self.cloning is not None:
+            self.cloning.cancel()
+            # the clone kills git and removes its directory once cancelled
+            await asyncio.gather(self.cloning, return_exceptions=True)
+            self.cloning = None
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+mirrors = {}
+
+
+def githubtoken():
+    return githubclient.githubtoken
+
+
+def getMirror(url, directory="mirrors", interval=60):
+    """
+    Returns the mirror of url, every url is mirrored once no matter how many prefixes use it.
+    """
+    if url not in mirrors:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        mirrors[url] = Mirror(
+            url, os.path.abspath(os.path.join(directory, f"{name}.git")), interval
+        )
+    return mirrors[url]
+
+
+async def close():
+    for mirror in mirrors.values():
+        await mirror.close()
@@ -0,0 +1,198 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+# the prefix of the request being served, tasks and threads started while serving it inherit the value
+prefix = contextvars.ContextVar("prefix", default="")
+# (name, seconds) entries of the current request, None if Server-Timing is disabled
+timings = contextvars.ContextVar("timings", default=None)
+registry = []
+caches = {}
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{formatLabels(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    defaultbuckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=defaultbuckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, timing=None, **labels):
+        """
+        Observes the duration of the with block. With timing the duration is added to the Server-Timing breakdown
+        of the current request as well.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.observe(duration, **labels)
+            if timing is not None:
+                addTiming(timing, duration)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            for bound, bucketcount in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{formatLabels(labels + (('le', bound),))} {bucketcount}"
+                )
+            lines.append(f"{self.name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{formatLabels(labels)} {total}")
+            lines.append(f"{self.name}_count{formatLabels(labels)} {count}")
+        return lines
+
+
+def addTiming(name, seconds):
+    entries = timings.get()
+    if entries is not None:
+        entries.append((name, seconds))
+
+
+def serverTiming(entries):
+    """
+    Formats timing entries as Server-Timing header, durations of entries with the same name are summed up.
+    """
+    durations = {}
+    for name, seconds in entries:
+        durations[name] = durations.get(name, 0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+def registerCache(name, cache):
+    caches[name] = cache
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    lines.append("# HELP configserver_cache_requests_total Cache lookups by result.")
+    lines.append("# TYPE configserver_cache_requests_total counter")
+    for name, cache in sorted(caches.items()):
+        lines.append(f'configserver_cache_requests_total{{cache="{name}",result="hit"}} {cache.hits}')
+        lines.append(f'configserver_cache_requests_total{{cache="{name}",result="miss"}} {cache.misses}')
+    lines.append("# HELP configserver_cache_entries Entries held per cache.")
+    lines.append("# TYPE configserver_cache_entries gauge")
+    for name, cache in sorted(caches.items()):
+        lines.append(f'configserver_cache_entries{{cache="{name}"}} {len(cache)}')
+    return "\n".join(lines) + "\n"
+
+
+backendLatency = Histogram(
+    "configserver_backend_request_seconds",
+    "Latency of backend lookups.",
+    ("prefix", "source"),
+)
+backendErrors = Counter(
+    "configserver_backend_errors_total",
+    "Failed or timed out backend lookups.",
+    ("prefix", "source"),
+)
+fetchedBytes = Counter(
+    "configserver_fetched_bytes_total",
+    "Bytes of configuration files fetched from backends.",
+    ("prefix", "source"),
+)
+parseTime = Histogram(
+    "configserver_parse_seconds",
+    "Time spent parsing configuration files.",
+    ("prefix", "format"),
+)
+searchPaths = Histogram(
+    "configserver_search_paths",
+    "Number of search paths generated per request.",
+    ("prefix", "kind"),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+requestLatency = Histogram(
+    "configserver_request_seconds",
+    "Latency of http requests.",
+    ("prefix", "method", "status"),
+)
+inflightRequests = Gauge(
+    "configserver_inflight_requests",
+    "Http requests currently being served.",
+    ("prefix",),
+)
+githubRateLimit = Gauge(
+    "configserver_github_ratelimit",
+    "Github rate limit as last reported (limit, remaining, reset) and conditional (notmodified) or throttled requests.",
+    ("kind",),
+)
+staleResponses = Counter(
+    "configserver_stale_responses_total",
+    "Responses answered from a stale snapshot while it is refreshed.",
+    ("prefix",),
+)
+circuitState = Gauge(
+    "configserver_circuit_open",
+    "1 while the circuit breaker of a backend is open (or half open), 0 while closed.",
+    ("backend",),
+)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import time
+
+import cache
+
+
+class Directory:
+    """
+    Serves configuration files from a local directory. Parsed files are kept in memory and only parsed again once
+    their mtime or size changed; with interval > 0 files are stat'ed at most every interval seconds.
+    """
+
+    def __init__(self, path, interval=0, clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        # file name -> (checked at, (mtime, size), parsed content)
+        self.files = {}
+
+    def lookup(self, searchedFiles, parse, read=None):
+        """
+        Returns {file name: parsed content} for every searched file that exists and a version digest of the files
+        found. parse(name, content) is only called for new or changed files, read(name, content) for every read.
+        """
+        results = {}
+        for name in dict.fromkeys(searchedFiles):
+            entry = self.file(name, parse, read)
+            if entry is not None:
+                results[name] = entry
+        version = hashlib.sha256(
+            ",".join(
+                f"{name}@{self.files[name][1][0]}:{self.files[name][1][1]}"
+                for name in results
+            ).encode("utf-8")
+        ).hexdigest()[:16]
+        return results, version
+
+    def file(self, name, parse, read=None):
+        now = self.clock()
+        entry = self.files.get(name)
+        if entry is not None and self.interval and entry[0] + self.interval > now:
+            return entry[2]
+        full = os.path.abspath(os.path.join(self.path, name))
+        base = os.path.abspath(self.path)
+        if os.path.commonpath([base, full]) != base:
+            # names may not leave the directory
+            return None
+        try:
+            stat = os.stat(full)
+        except (FileNotFoundError, NotADirectoryError):
+            self.files.pop(name, None)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if entry is not None and entry[1] == signature:
+            self.files[name] = (now, signature, entry[2])
+            return entry[2]
+        with open(full, "rb") as file:
+            content = file.read()
+        if read is not None:
+            read(name, content)
+        self.files[name] = (now, signature, parse(name, content))
+        return self.files[name][2]
+
+
+# path -> Directory, bounded as paths with {label} depend on the request
+directories = cache.LRUCache(maxsize=64)
+
+
+def getDirectory(path, interval=0):
+    path = os.path.abspath(path)
+    directory = directories.get(path)
+    if directory is None:
+        directory = directories.put(path, Directory(path, interval))
+    return directory
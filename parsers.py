@@ -0,0 +1,193 @@
+import hashlib
+import sys
+from collections.abc import MutableMapping
+
+import yaml
+
+import cache
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+escapes = {"t": "\t", "n": "\n", "r": "\r", "f": "\f"}
+# (format, sha256 of the content) -> Documents, identical files are parsed once no matter where they come from
+parsecache = cache.LRUCache(maxsize=1024)
+
+
+class Properties(dict):
+    """
+    A flat property map which can not be changed. Parsed files are shared by every prefix, request and cache holding
+    them, so nobody may modify them in place.
+    """
+
+    def readonly(self, *args, **kwargs):
+        raise TypeError("Properties are immutable")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = readonly
+
+    def __reduce__(self):
+        return Properties, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class Documents(list):
+    """
+    The parsed documents of one configuration file as (activation profiles, flat properties) tuples. The activation
+    is None for documents which apply to every profile.
+    """
+
+    def select(self, profiles):
+        """
+        Returns (index, properties) of the documents active for profiles, later documents first as they win.
+        """
+        return [
+            (i, properties)
+            for i, (activation, properties) in reversed(list(enumerate(self)))
+            if activation is None or isActive(activation, profiles)
+        ]
+
+
+def isActive(activation, profiles):
+    """
+    Evaluates spring.config.activate.on-profile: any of the (comma or | separated) terms has to match, !name
+    matches when the profile is not active.
+    """
+    for term in activation:
+        term = term.strip()
+        if term.startswith("!") and term[1:].strip() not in profiles:
+            return True
+        if not term.startswith("!") and term in profiles:
+            return True
+    return False
+
+
+def flatten(d, parent_key="", sep=".", items=None):
+    """
+    Flattens nested mappings into "a.b.c" keys, writing into a single dict instead of merging per level. Keys are
+    interned, the same property names in many files are held once.
+    """
+    items = {} if items is None else items
+    if not d:
+        return items
+    for k, v in d.items():
+        new_key = sys.intern(f"{parent_key}{sep}{k}" if parent_key else str(k))
+        if isinstance(v, MutableMapping):
+            flatten(v, new_key, sep, items)
+        else:
+            items[new_key] = v
+    return items
+
+
+def activation(properties):
+    """
+    Returns the profile terms a flattened document is restricted to, None if it applies to every profile.
+    """
+    profile = properties.get("spring.config.activate.on-profile")
+    if profile is None:
+        # the pre spring boot 2.4 spelling
+        profile = properties.get("spring.profiles")
+    if profile is None:
+        return None
+    terms = profile if isinstance(profile, list) else str(profile).replace("|", ",").split(",")
+    return tuple(str(term).strip() for term in terms)
+
+
+def parseYaml(content):
+    documents = Documents()
+    for document in yaml.load_all(content, Loader=SafeLoader):
+        if not isinstance(document, MutableMapping):
+            continue
+        properties = Properties(flatten(document))
+        documents.append((activation(properties), properties))
+    return documents
+
+
+def logicalLines(text):
+    """
+    Yields the logical lines of a properties file: comments and blank lines are dropped, continuation lines (ending
+    in an odd number of backslashes) are joined with the leading whitespace of the next line removed.
+    """
+    current = None
+    for line in text.splitlines():
+        if current is None:
+            line = line.lstrip(" \t\f")
+            if not line or line[0] in "#!":
+                continue
+        else:
+            line = current + line.lstrip(" \t\f")
+        backslashes = len(line) - len(line.rstrip("\\"))
+        if backslashes % 2 == 1:
+            current = line[:-1]
+            continue
+        current = None
+        yield line
+    if current is not None:
+        yield current
+
+
+def unescape(text):
+    if "\\" not in text:
+        return text
+    result = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\" and i + 1 < len(text):
+            char = text[i + 1]
+            if char == "u" and i + 6 <= len(text):
+                try:
+                    result.append(chr(int(text[i + 2 : i + 6], 16)))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            result.append(escapes.get(char, char))
+            i += 2
+            continue
+        result.append(char)
+        i += 1
+    return "".join(result)
+
+
+def parseProperties(content):
+    """
+    Parses java .properties: "=", ":" or whitespace separate key and value, escapes and continuation lines are
+    supported.
+    """
+    properties = {}
+    for line in logicalLines(content.decode("utf-8") if isinstance(content, bytes) else content):
+        end = 0
+        while end < len(line):
+            if line[end] == "\\":
+                end += 2
+                continue
+            if line[end] in "=: \t\f":
+                break
+            end += 1
+        key = line[:end]
+        # whitespace, at most one "=" or ":" and more whitespace separate key and value
+        rest = line[end:].lstrip(" \t\f")
+        if rest[:1] in ("=", ":"):
+            rest = rest[1:].lstrip(" \t\f")
+        properties[sys.intern(unescape(key))] = unescape(rest)
+    return Documents([(None, Properties(properties))])
+
+
+def kind(path):
+    return "yaml" if path.endswith(".yaml") or path.endswith(".yml") else "properties"
+
+
+def parse(path, content):
+    """
+    Parses a configuration file by its extension, results are cached by the hash of the content.
+    """
+    key = (kind(path), hashlib.sha256(content).hexdigest())
+    documents = parsecache.get(key)
+    if documents is None:
+        documents = parsecache.put(
+            key, parseYaml(content) if key[0] == "yaml" else parseProperties(content)
+        )
+    return documents
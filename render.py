@@ -0,0 +1,90 @@
+import json
+
+import yaml
+
+import cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# the libyaml emitter is an order of magnitude faster than the pure python one
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+mediatypes = {
+    "properties": "application/text",
+    "yml": "application/x-yaml",
+    "yaml": "application/x-yaml",
+    "json": "application/json",
+}
+# (etag, fileending) -> rendered body, the etag already identifies version, request and format
+renders = cache.LRUCache(maxsize=256)
+
+
+def mergeSources(propertySources):
+    """
+    Merges the property sources into one flat map, sources earlier in the list win.
+    """
+    content = {}
+    for propertySource in reversed(propertySources):
+        content.update(propertySource["source"])
+    return content
+
+
+def generateWideMap(map, sep="."):
+    """
+    Expands a flat map into a nested tree in a single pass over the keys. Keys which collide with an already
+    assigned value (e.g. "a" and "a.b") keep the value that came first.
+    """
+    rval = {}
+    for key, value in map.items():
+        *parents, leaf = key.split(sep)
+        trval = rval
+        for item in parents:
+            node = trval.get(item)
+            if node is None:
+                node = trval[item] = {}
+            elif not isinstance(node, dict):
+                break
+            trval = node
+        else:
+            if leaf not in trval:
+                trval[leaf] = value
+    return rval
+
+
+def renderProperties(content):
+    return "\n".join([f"{key}={value}" for key, value in content.items()]).encode("utf-8")
+
+
+def renderYaml(content):
+    return yaml.dump(generateWideMap(content), Dumper=SafeDumper).encode("utf-8")
+
+
+def renderJson(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=str)
+    return json.dumps(content, separators=(",", ":"), default=str).encode("utf-8")
+
+
+renderers = {
+    "properties": renderProperties,
+    "yml": renderYaml,
+    "yaml": renderYaml,
+    "json": renderJson,
+}
+
+
+def render(propertySources, fileending, tag=None):
+    """
+    Renders the merged property sources in the format of fileending. Bodies with an etag are memoized, an unchanged
+    version is rendered only once.
+    """
+    if tag is not None:
+        body = renders.get((tag, fileending))
+        if body is not None:
+            return body
+    body = renderers[fileending](mergeSources(propertySources))
+    if tag is not None:
+        renders.put((tag, fileending), body)
+    return body
@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import parsers
+
+
+def encode(value):
+    """
+    Turns a cached value (refs, tree indexes, parsed files) into plain json. Everything but strings, numbers, bools,
+    None and lists is stored as {tag: data}, so reading an entry back can only ever build these types.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list) and not isinstance(value, parsers.Documents):
+        return [encode(item) for item in value]
+    if isinstance(value, parsers.Documents):
+        return {"documents": [encode(document) for document in value]}
+    if isinstance(value, tuple):
+        return {"tuple": [encode(item) for item in value]}
+    if isinstance(value, parsers.Properties):
+        return {"properties": [[key, encode(item)] for key, item in value.items()]}
+    if isinstance(value, dict):
+        return {"dict": [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, datetime.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"date": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (set, frozenset)):
+        return {"set": [encode(item) for item in value]}
+    raise TypeError(f"can not store {type(value).__name__} in the shared cache")
+
+
+def decode(data):
+    if not isinstance(data, (dict, list)):
+        return data
+    if isinstance(data, list):
+        return [decode(item) for item in data]
+    (tag, value), = data.items()
+    if tag == "documents":
+        return parsers.Documents(decode(document) for document in value)
+    if tag == "tuple":
+        return tuple(decode(item) for item in value)
+    if tag == "properties":
+        return parsers.Properties((sys.intern(key), decode(item)) for key, item in value)
+    if tag == "dict":
+        return {decode(key): decode(item) for key, item in value}
+    if tag == "datetime":
+        return datetime.datetime.fromisoformat(value)
+    if tag == "date":
+        return datetime.date.fromisoformat(value)
+    if tag == "bytes":
+        return base64.b64decode(value)
+    if tag == "set":
+        return {decode(item) for item in value}
+    raise ValueError(f"unknown tag {tag} in the shared cache")
+
+
+class SharedCache:
+    """
+    A cache shared by all worker processes of a host, stored in a (memory mapped) sqlite database in WAL mode.
+    Leases coordinate the workers so that only one of them fetches a missing key while the others wait for it.
+    Values are stored as tagged json, never as pickles: whoever can write the database can not run code in the
+    workers. A database owned by another user is refused all the same, as it could serve them any configuration.
+    """
+
+    def __init__(self, path, leasetime=10, maxentries=100000):
+        self.path = path
+        self.leasetime = leasetime
+        self.maxentries = maxentries
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        if os.stat(path).st_uid != os.getuid():
+            self.connection.close()
+            raise PermissionError(f"{path} is owned by another user")
+        os.chmod(path, 0o600)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("PRAGMA mmap_size=268435456")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value BLOB, created REAL, expires REAL)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires REAL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        try:
+            value = decode(json.loads(row[0]))
+        except ValueError:
+            # written by an older version
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value, ttl=None):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, expires) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(encode(value), separators=(",", ":")), now, now + ttl if ttl else None),
+            )
+            self.puts += 1
+            if self.puts % 100 == 0:
+                self.prune(now)
+        return value
+
+    def prune(self, now):
+        self.connection.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+        self.connection.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY created LIMIT max(0, (SELECT count(*) FROM entries) - ?))",
+            (self.maxentries,),
+        )
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def acquire(self, key, owner=None):
+        """
+        Tries to take the lease on key, returns True if owner (default: this process) may fetch it.
+        """
+        owner = owner or self.owner
+        now = time.time()
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+            self.connection.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                (key, owner, now + self.leasetime),
+            )
+            row = self.connection.execute("SELECT owner FROM leases WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release(self, key, owner=None):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner or self.owner)
+            )
+
+    async def lookup(self, key, fetch, ttl=None, poll=0.05):
+        """
+        Returns the shared value of key. On a miss the worker holding the lease awaits fetch() and stores the result,
+        the others poll for it and only fetch themselves if the lease expires without a value.
+        """
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            return value
+        # every lookup is its own owner, so concurrent lookups within a worker are coordinated as well
+        owner = f"{self.owner}-{uuid.uuid4().hex[:8]}"
+        deadline = time.monotonic() + self.leasetime
+        while not await asyncio.to_thread(self.acquire, key, owner):
+            await asyncio.sleep(poll)
+            value = await asyncio.to_thread(self.get, key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                return await fetch()
+        try:
+            # another worker may have stored the value between the miss and taking the lease
+            value = await asyncio.to_thread(self.get, key)
+            if value is None:
+                value = await fetch()
+                if value is not None:
+                    await asyncio.to_thread(self.put, key, value, ttl)
+            return value
+        finally:
+            await asyncio.to_thread(self.release, key, owner)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
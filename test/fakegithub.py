@@ -0,0 +1,118 @@
+import hashlib
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+from test.fakeserver import FakeServer
+
+
+def blobSha(content):
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class FakeGithub(FakeServer):
+    """
+    A local stand-in for the parts of the github rest api the configserver uses. repos maps a repository name to its
+    branches, every branch maps file paths to their (bytes) content.
+    """
+
+    def __init__(self, repos, latency=0, truncate=False, ratelimit=None):
+        super().__init__(latency=latency)
+        self.repos = repos
+        # requests left before answers are 403, None for no rate limit; 304 answers are free like on github
+        self.limit = ratelimit
+        self.remaining = ratelimit
+        self.reset = int(time.time()) + 3600
+        # answer recursive tree requests as truncated, like github does for very large trees
+        self.truncate = truncate
+
+    def commits(self):
+        """
+        Returns {commit sha: (repository, files)} for every branch, the commit sha is derived from the file contents.
+        """
+        commits = {}
+        for repository, branches in self.repos.items():
+            for branch, files in branches.items():
+                commits[self.commitSha(files)] = (repository, files)
+        return commits
+
+    def commitSha(self, files):
+        return hashlib.sha1(
+            "".join(path + blobSha(files[path]) for path in sorted(files)).encode()
+        ).hexdigest()
+
+    def treeSha(self, files, directory):
+        return hashlib.sha1(f"{self.commitSha(files)}:{directory}".encode()).hexdigest()
+
+    def tree(self, sha, commits, branches, recursive):
+        """
+        Answers the git trees api, sha is a commit sha, branch or the tree sha of a directory of one of them.
+        """
+        trees = {}
+        for _, files in commits.values():
+            trees[self.commitSha(files)] = (files, "")
+            for path in files:
+                parts = path.split("/")[:-1]
+                for i in range(1, len(parts) + 1):
+                    trees[self.treeSha(files, "/".join(parts[:i]))] = (files, "/".join(parts[:i]) + "/")
+        files, directory = trees.get(sha, (branches.get(sha), ""))
+        if files is None:
+            return 404, b"{}", {}
+        entries = {}
+        for path, content in files.items():
+            if not path.startswith(directory):
+                continue
+            name = path[len(directory):]
+            if recursive and not self.truncate:
+                entries[name] = {"path": name, "type": "blob", "sha": blobSha(content)}
+            elif "/" in name:
+                subtree = name.split("/")[0]
+                entries[subtree] = {"path": subtree, "type": "tree",
+                                    "sha": self.treeSha(files, directory + subtree)}
+            else:
+                entries[name] = {"path": name, "type": "blob", "sha": blobSha(content)}
+        tree = {"sha": sha, "tree": list(entries.values()), "truncated": recursive and self.truncate}
+        return 200, json.dumps(tree).encode(), {"Content-Type": "application/json"}
+
+    def rateLimitHeaders(self):
+        if self.limit is None:
+            return {}
+        return {"X-RateLimit-Limit": str(self.limit), "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+                "X-RateLimit-Reset": str(self.reset)}
+
+    def handle(self, request):
+        if self.limit is not None and self.remaining <= 0:
+            return 403, b'{"message": "API rate limit exceeded"}', self.rateLimitHeaders()
+        status, body, headers = self.route(request)
+        if status == 200:
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if request.headers.get("If-None-Match") == etag:
+                return 304, b"", {"ETag": etag, **self.rateLimitHeaders()}
+            headers = {**headers, "ETag": etag}
+        if self.limit is not None:
+            self.remaining -= 1
+        return status, body, {**headers, **self.rateLimitHeaders()}
+
+    def route(self, request):
+        url = urlparse(request.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) < 4 or parts[0] != "repos":
+            return 404, b"{}", {}
+        repository = "/".join(parts[1:3])
+        branches = self.repos.get(repository, {})
+        commits = self.commits()
+        if parts[3] == "commits":
+            ref = parts[4]
+            if ref in branches:
+                return 200, self.commitSha(branches[ref]).encode(), {}
+            if ref in commits and commits[ref][0] == repository:
+                return 200, ref.encode(), {}
+            return 422, b'{"message": "No commit found"}', {}
+        if parts[3:5] == ["git", "trees"]:
+            return self.tree(parts[5], commits, branches, parse_qs(url.query).get("recursive") == ["1"])
+        if parts[3:5] == ["git", "blobs"]:
+            for files in branches.values():
+                for content in files.values():
+                    if blobSha(content) == parts[5]:
+                        return 200, content, {}
+        return 404, b"{}", {}
@@ -0,0 +1,39 @@
+import json
+
+from test.fakeserver import FakeServer
+
+
+class FakeVault(FakeServer):
+    """
+    A local stand-in for the kv v2 api of vault. mounts maps a mount point to its secrets, every secret path maps to
+    its data. Writing a secret with put() creates a new version.
+    """
+
+    def __init__(self, mounts, latency=0):
+        super().__init__(latency=latency)
+        self.mounts = mounts
+        self.versions = {}
+
+    def put(self, mount, path, data):
+        self.mounts.setdefault(mount, {})[path] = data
+        self.versions[(mount, path)] = self.version(mount, path) + 1
+
+    def version(self, mount, path):
+        return self.versions.get((mount, path), 1)
+
+    def handle(self, request):
+        parts = request.path.split("?")[0].strip("/").split("/", 3)
+        if len(parts) < 4 or parts[0] != "v1":
+            return 404, b'{"errors": []}', {}
+        _, mount, kind, path = parts
+        secrets = self.mounts.get(mount, {})
+        if path not in secrets:
+            return 404, b'{"errors": []}', {"Content-Type": "application/json"}
+        version = self.version(mount, path)
+        if kind == "data":
+            body = {"data": {"data": secrets[path], "metadata": {"version": version}}}
+        elif kind == "metadata":
+            body = {"data": {"current_version": version}}
+        else:
+            return 404, b'{"errors": []}', {}
+        return 200, json.dumps(body).encode(), {"Content-Type": "application/json"}
@@ -0,0 +1,47 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.case import TestCase
+import asyncio
+import cache
+
+
+class LRUCacheTest(TestCase):
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        lru.get("a")
+        lru.put("c", 3)
+        self.assertTrue("a" in lru)
+        self.assertFalse("b" in lru)
+        self.assertEqual(lru.get("c"), 3)
+        self.assertEqual((lru.hits, lru.misses), (2, 0))
+
+
+class TTLCacheTest(TestCase):
+    def test_entries_expire(self):
+        now = [0]
+        ttl = cache.TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        ttl.put("main", "sha")
+        now[0] = 10
+        self.assertEqual(ttl.get("main"), "sha")
+        now[0] = 11
+        self.assertIsNone(ttl.get("main"))
+        self.assertEqual(len(ttl), 0)
+        self.assertEqual((ttl.hits, ttl.misses), (1, 1))
+
+
+class SingleFlightTest(IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_result(self):
+        flight = cache.SingleFlight()
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value
+        results = await asyncio.gather(
+            *[flight.do("a", lambda: work(1)) for _ in range(5)], flight.do("b", lambda: work(2)))
+        self.assertEqual(results, [1, 1, 1, 1, 1, 2])
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(len(flight), 0)
+        self.assertEqual(await flight.do("a", lambda: work(3)), 3)
@@ -0,0 +1,41 @@
+from unittest.case import TestCase
+
+import circuitbreaker
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.breaker = circuitbreaker.CircuitBreaker("test", threshold=2, cooldown=10, clock=lambda: self.now)
+        return super().setUp()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.check()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "open")
+        with self.assertRaises(circuitbreaker.Open):
+            self.breaker.check()
+
+    def test_single_probe_after_cooldown(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+        self.assertEqual(self.breaker.state, "halfopen")
+        self.breaker.check()
+        with self.assertRaises(circuitbreaker.Open):
+            self.breaker.check()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.now = 20
+        self.breaker.check()
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.check()
+
+    def test_breakers_are_shared_per_backend(self):
+        circuitbreaker.breakers.clear()
+        self.assertIs(circuitbreaker.getBreaker("github:r/r"), circuitbreaker.getBreaker("github:r/r"))
+        self.assertIsNot(circuitbreaker.getBreaker("github:r/r"), circuitbreaker.getBreaker("vault:x"))
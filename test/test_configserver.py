@@ -1,8 +1,21 @@
 from unittest import IsolatedAsyncioTestCase
 from unittest.case import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
 import configserver
+import githubclient
+import sharedcache
 import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+import os
+import tempfile
+import hvac
+from fastapi import HTTPException
+from test.fakegithub import FakeGithub
 
 
 def async_return(result):
@@ -11,6 +24,10 @@ def async_return(result):
     return f
 
 
+# ConfigserverTest replaces the backends for good
+realGetFromVault = configserver.getFromVault
+
+
 class ConfigserverTest(IsolatedAsyncioTestCase):
     def setUp(self) -> None:
         configserver.getFromGithub = MagicMock(
@@ -57,3 +74,507 @@ class FlattenDict(TestCase):
     def test_flattenMethod(self):
         value = configserver.flatten({"asd": {"bsd": {"csd": {"dsd": "esd"}}}})
         self.assertEqual({"asd.bsd.csd.dsd": "esd"}, value)
+
+
+class CombineTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.getFromGithub = configserver.getFromGithub
+        self.getFromVault = configserver.getFromVault
+
+        async def slowGithub(label, searchedFiles, repository):
+            await asyncio.sleep(0.2 if label != "slow" else 5)
+            return {f"https://github.com/{repository}/test.yaml": {"label": label}}
+
+        async def brokenVault(searchedNames, secretpath, vaulttoken, vaultcache=None):
+            raise hvac.exceptions.InternalServerError("down")
+        configserver.getFromGithub = slowGithub
+        configserver.getFromVault = brokenVault
+        configserver.circuitbreaker.breakers.clear()
+        configserver.snapshots.clear()
+        self.settings = {**configserver.configreader.prefixdefaults, "github": "repo", "vault": "secret",
+                         "timeout": {"github": 1, "vault": 1},
+                         "policy": {"github": "fail", "vault": "partial"}}
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        configserver.getFromGithub = self.getFromGithub
+        configserver.getFromVault = self.getFromVault
+        return super().tearDown()
+
+    async def test_watch_refresh_bypasses_the_shared_cache(self):
+        async def resolveRef(repository, label):
+            return "new"
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = sharedcache.SharedCache(os.path.join(tmp, "shared.db"))
+            shared.put("ref:repo:main", "old")
+            configserver.refcache.put(("repo", "main"), "old", 60)
+            try:
+                with patch.object(configserver, "shared", shared), \
+                        patch.object(configserver.githubclient, "resolveRef", resolveRef):
+                    await configserver.refreshSources(frozenset([("ref", "repo", "main")]))
+                self.assertEqual(configserver.refcache.get(("repo", "main")), "new")
+                self.assertEqual(shared.get("ref:repo:main"), "new")
+            finally:
+                configserver.refcache.clear()
+                shared.close()
+
+    async def test_labels_are_fetched_concurrently(self):
+        start = time.monotonic()
+        combined = await configserver.combine(
+            ["test"], [], ["a", "b", "c"], None, github="repo", settings=self.settings)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(combined["propertySources"][0]["source"], {"label": "c"})
+        self.assertEqual(combined["degraded"], [])
+
+    async def test_partial_policy_marks_source_degraded(self):
+        combined = await configserver.combine(
+            ["test"], [], ["a"], "token", github="repo", settings=self.settings)
+        self.assertEqual(len(combined["propertySources"]), 1)
+        self.assertEqual(combined["degraded"], ["vault"])
+        env = configserver.environment("test", [], "a", combined)
+        self.assertEqual(env["state"], "degraded: vault")
+
+    async def test_rejected_tokens_mark_vault_degraded(self):
+        configserver.getFromVault = realGetFromVault
+        client = MagicMock()
+        client.secrets.kv.read_secret_version.side_effect = hvac.exceptions.Forbidden("permission denied")
+        client.auth.token.lookup_self.side_effect = hvac.exceptions.Forbidden("permission denied")
+        address = configserver.configreader.getVaultAddress()
+        configserver.vaultclient.clients.put((address, configserver.vaultclient.tokenHash("expired")), client)
+        try:
+            combined = await configserver.combine(
+                ["test"], [], ["a"], "expired", github="repo", settings=self.settings)
+            self.assertEqual(combined["degraded"], ["vault"])
+            self.assertEqual(configserver.breakerFor(f"vault:{address}").failures, 0)
+            client.auth.token.lookup_self.side_effect = None
+            combined = await configserver.combine(
+                ["test"], [], ["b"], "expired", github="repo", settings=self.settings)
+            self.assertEqual(combined["degraded"], [])
+        finally:
+            configserver.vaultclient.clients.clear()
+
+    async def test_identical_requests_are_coalesced_per_token(self):
+        calls = []
+        github = configserver.getFromGithub
+
+        async def countingGithub(**kwargs):
+            calls.append(kwargs["label"])
+            return await github(**kwargs)
+        configserver.getFromGithub = countingGithub
+        configserver.getFromVault = MagicMock(side_effect=lambda **kwargs: async_return({}))
+        results = await asyncio.gather(*[configserver.combine(
+            ["test"], [], ["a"], token, github="repo", settings=self.settings)
+            for token in ["t1", "t1", "t1", "t2"]])
+        self.assertEqual(len(calls), 2)
+        self.assertIs(results[0], results[1])
+        self.assertIsNot(results[0], results[3])
+        self.assertEqual(configserver.getFromVault.call_args_list[0].kwargs["vaulttoken"], "t1")
+        self.assertEqual(configserver.getFromVault.call_args_list[1].kwargs["vaulttoken"], "t2")
+
+    async def test_fail_policy_fails_request_on_timeout(self):
+        with self.assertRaises(HTTPException) as e:
+            await configserver.combine(
+                ["test"], [], ["a", "slow"], None, github="repo", settings=self.settings)
+        self.assertEqual(e.exception.status_code, 504)
+
+    async def test_prefixes_with_the_same_settings_share_fetches(self):
+        calls = []
+        github = configserver.getFromGithub
+
+        async def countingGithub(**kwargs):
+            calls.append(kwargs["label"])
+            return await github(**kwargs)
+        configserver.getFromGithub = countingGithub
+        results = await asyncio.gather(*[configserver.combine(
+            ["test"], [], ["a"], None, github="repo", settings=dict(self.settings), prefix=prefix)
+            for prefix in ["default", "apps", "apps"]])
+        self.assertEqual(len(calls), 1)
+        self.assertIs(results[0], results[1])
+        await configserver.combine(["test"], [], ["a"], None, github="repo",
+                                   settings={**self.settings, "searchpaths": ["{application}"]}, prefix="bapps")
+        self.assertEqual(len(calls), 2)
+
+    async def test_open_circuit_skips_the_backend(self):
+        calls = []
+
+        async def countingVault(**kwargs):
+            calls.append(kwargs)
+            raise hvac.exceptions.InternalServerError("down")
+        configserver.getFromVault = countingVault
+        with patch.dict(configserver.configreader.circuitbreakersettings, threshold=2, cooldown=60):
+            for _ in range(4):
+                combined = await configserver.combine(
+                    ["test"], [], ["a"], "token", github="repo", settings=self.settings)
+                self.assertEqual(combined["degraded"], ["vault"])
+        self.assertEqual(len(calls), 2)
+        breaker = configserver.circuitbreaker.breakers[f"vault:{configserver.configreader.getVaultAddress()}"]
+        self.assertEqual(breaker.state, "open")
+
+    async def test_cancelled_or_unexpectedly_failing_probes_end(self):
+        breaker = configserver.circuitbreaker.getBreaker("test", threshold=1, cooldown=0)
+        breaker.failure()
+
+        async def hanging():
+            await asyncio.sleep(5)
+        probe = asyncio.ensure_future(configserver.fetchSource("test", hanging(), 10, "partial", [], breaker=breaker))
+        await asyncio.sleep(0.05)
+        self.assertTrue(breaker.probing)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        self.assertFalse(breaker.probing)
+
+        async def broken():
+            raise KeyError("sha")
+        with self.assertRaises(KeyError):
+            await configserver.fetchSource("test", broken(), 10, "partial", [], breaker=breaker)
+        self.assertFalse(breaker.probing)
+        self.assertEqual(breaker.failures, 2)
+
+    async def test_stale_snapshots_are_served_while_refreshing(self):
+        settings = {**self.settings, "stale": {"enabled": True, "fresh": 0, "maxage": 60}}
+        first = await configserver.combine(["test"], [], ["a"], None, github="repo", settings=settings)
+        self.assertNotIn("stale", first)
+        start = time.monotonic()
+        second = await configserver.combine(["test"], [], ["a"], None, github="repo", settings=settings)
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(second["propertySources"], first["propertySources"])
+        self.assertGreaterEqual(second["stale"], 0)
+        env = configserver.environment("test", [], "a", second)
+        self.assertTrue(env["state"].startswith("stale: "))
+        self.assertIn("X-Config-Stale", configserver.responseHeaders(second))
+        # the background refresh replaces the snapshot
+        snapshot = next(iter(configserver.snapshots.entries.values()))
+        await asyncio.gather(*configserver.refreshing.values())
+        self.assertGreater(next(iter(configserver.snapshots.entries.values()))[0], snapshot[0])
+
+
+# ConfigserverTest replaces the backends with mocks, keep the originals around
+getFromGithub = configserver.getFromGithub
+
+
+class GithubCacheTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.github = FakeGithub({"r/r": {"main": {
+            "application.yaml": b"foo:\n  bar: baz\n",
+            "application.properties": b"a=b\nc=d=e\n",
+            "other.yaml": b"x: y\n"}}}).start()
+        self.apiurl = githubclient.apiurl
+        githubclient.apiurl = self.github.url
+        configserver.refcache.clear()
+        configserver.listingcache.clear()
+        configserver.sourcecache.clear()
+        return super().setUp()
+
+    async def asyncTearDown(self) -> None:
+        await githubclient.close()
+        githubclient.apiurl = self.apiurl
+        self.github.stop()
+
+    async def test_repeated_lookups_hit_the_cache(self):
+        for _ in range(3):
+            value = await getFromGithub(
+                label="main", searchedFiles=["application.yaml", "application.properties"], repository="r/r")
+            self.assertEqual(value, {
+                "https://github.com/r/r/application.yaml": {"foo.bar": "baz"},
+                "https://github.com/r/r/application.properties": {"a": "b", "c": "d=e"}})
+        self.assertEqual(len(self.github.requests), 4)
+
+    async def test_concurrent_lookups_share_upstream_calls(self):
+        self.github.repos["r/s"] = {"main": {"application.yaml": b"foo:\n  bar: baz\n"}}
+        values = await asyncio.gather(*[getFromGithub(
+            label="main", searchedFiles=["application.yaml", "other.yaml"], repository=repository)
+            for repository in ["r/r", "r/r", "r/s", "r/r"]])
+        self.assertEqual(len([r for r in self.github.requests if "/commits/" in r]), 2)
+        self.assertEqual(len([r for r in self.github.requests if "/git/trees/" in r]), 2)
+        # identical files are fetched, parsed and held once
+        self.assertEqual(len([r for r in self.github.requests if "/git/blobs/" in r]), 2)
+        self.assertIs(values[0]["https://github.com/r/r/application.yaml"],
+                      values[2]["https://github.com/r/s/application.yaml"])
+
+    async def test_unknown_ref_is_empty(self):
+        value = await getFromGithub(
+            label="nope", searchedFiles=["application.yaml"], repository="r/r")
+        self.assertEqual(value, {})
+
+
+class ServerTest(TestCase):
+    """
+    Runs the app against a local github stand-in.
+    """
+
+    def setUp(self) -> None:
+        self.files = {"application.yaml": b"foo:\n  bar: baz\n", "test-dev.yaml": b"a: b\n",
+                      "other.properties": b"c=d\n", "application-dev.yaml": b"e: f\n"}
+        self.github = FakeGithub({"r/r": {"main": self.files}}).start()
+        self.apiurl = githubclient.apiurl
+        githubclient.apiurl = self.github.url
+        configserver.refcache.clear()
+        configserver.listingcache.clear()
+        configserver.sourcecache.clear()
+        configserver.knownrefs.clear()
+        configserver.circuitbreaker.breakers.clear()
+        githubclient.etags.clear()
+        githubclient.ratelimit.update(limit=None, remaining=None, reset=None, blocked=0.0)
+        self.patches = [
+            patch.object(configserver, "getFromGithub", getFromGithub),
+            patch.object(configserver.configreader, "getConfig",
+                         return_value={"default": {"github": "r/r", "vault": "secret"}}),
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = TestClient(configserver.app).__enter__()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.client.__exit__(None, None, None)
+        for p in self.patches:
+            p.stop()
+        githubclient.apiurl = self.apiurl
+        self.github.stop()
+        return super().tearDown()
+
+
+class EntityTagTest(ServerTest):
+    def test_unchanged_config_is_not_modified(self):
+        for url in ["/test/dev/main", "/test/dev", "/test.json", "/test-dev.yml", "/test-dev.properties", "/test-dev.json"]:
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.headers["ETag"].startswith('"'))
+            second = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            self.assertEqual(second.status_code, 304, url)
+            self.assertEqual(second.content, b"")
+        self.assertNotEqual(self.client.get("/test/dev").headers["ETag"], self.client.get("/test.json").headers["ETag"])
+
+    def test_version_follows_the_commit(self):
+        first = self.client.get("/test/dev/main")
+        self.assertEqual(first.json()["version"], self.github.commitSha(self.files))
+        self.files["test-dev.yaml"] = b"a: c\n"
+        configserver.refcache.clear()
+        second = self.client.get("/test/dev/main", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["version"], self.github.commitSha(self.files))
+        self.assertNotEqual(second.headers["ETag"], first.headers["ETag"])
+
+
+class MetricsTest(ServerTest):
+    def test_metrics_and_server_timing(self):
+        with patch.dict(configserver.configreader.metricssettings, {"servertiming": True}):
+            response = self.client.get("/test/dev/main")
+        self.assertIn("github;dur=", response.headers["Server-Timing"])
+        self.assertIn("parse;dur=", response.headers["Server-Timing"])
+        self.assertNotIn("Server-Timing", self.client.get("/test/dev/main").headers)
+        body = self.client.get("/metrics").text
+        self.assertIn('configserver_backend_request_seconds_count{prefix="default",source="github"}', body)
+        self.assertIn('configserver_parse_seconds_count{prefix="default",format="yaml"}', body)
+        self.assertIn('configserver_fetched_bytes_total{prefix="default",source="github"}', body)
+        self.assertIn('configserver_search_paths_count{prefix="default",kind="files"}', body)
+        self.assertIn('configserver_cache_requests_total{cache="source",result="hit"}', body)
+        self.assertIn('configserver_inflight_requests{prefix="default"} 1', body)
+
+    def test_unknown_prefixes_share_one_label(self):
+        for prefix in ["a", "b"]:
+            self.client.get("/ready", headers={"prefix": prefix})
+        body = self.client.get("/metrics").text
+        self.assertIn('prefix="unknown"', body)
+        self.assertNotIn('prefix="a"', body)
+        self.assertNotIn('prefix="b"', body)
+
+
+class WarmupTest(ServerTest):
+    def setUp(self) -> None:
+        self.warmup = patch.dict(configserver.configreader.warmupsettings, {"enabled": True, "labels": ["main"]})
+        self.warmup.start()
+        super().setUp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.warmup.stop()
+
+    def test_prefetched_config_needs_no_upstream_requests(self):
+        for _ in range(50):
+            if self.client.get("/ready").status_code == 200:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.client.get("/ready").json(), {"status": "UP"})
+        self.assertEqual(len(self.github.requests), 6)
+        response = self.client.get("/test/dev/main")
+        self.assertEqual(len(response.json()["propertySources"]), 3)
+        self.assertEqual(len(self.github.requests), 6)
+
+
+class BatchTest(ServerTest):
+    def test_batch_matches_single_requests_and_fetches_once(self):
+        items = [{"application": "test", "profile": "dev"}, {"application": "other", "profile": "dev"},
+                 {"application": "other", "label": "main"}, {"application": "test", "profile": "dev", "label": "nope"}]
+        response = self.client.post("/batch", json=items)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        envs = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(len(envs), 4)
+        # one ref per label, one listing and one blob per file
+        self.assertEqual(len([r for r in self.github.requests if "/git/blobs/" in r]), 4)
+        self.assertEqual(len([r for r in self.github.requests if "/commits/" in r]), 2)
+        for item in items[:3]:
+            env = next(env for env in envs if env["name"] == item["application"]
+                       and env["profiles"] == ([item["profile"]] if "profile" in item else [])
+                       and env["label"] == item.get("label", "main"))
+            single = self.client.get(f"/{item['application']}/{item.get('profile', 'default')}/main").json() \
+                if "profile" in item else self.client.get(f"/{item['application']}.json").json()
+            self.assertEqual(env["propertySources"], single["propertySources"])
+        self.assertEqual([env["propertySources"] for env in envs if env["label"] == "nope"], [[]])
+
+
+class MultiDocumentTest(ServerTest):
+    def test_profile_documents_are_selected(self):
+        self.files["multi.yaml"] = (b"port: 1\n---\nspring.config.activate.on-profile: dev\nport: 2\n"
+                                    b"---\nspring:\n  profiles: prod\nport: 3\n")
+        url = "https://github.com/r/r/multi.yaml"
+        sources = self.client.get("/multi/dev/main").json()["propertySources"]
+        self.assertEqual([(s["name"], s["source"]["port"]) for s in sources if s["name"].startswith(url)],
+                         [(f"{url} (document #1)", 2), (f"{url} (document #0)", 1)])
+        self.assertEqual(self.client.get("/multi-dev.json").json()["port"], 2)
+        self.assertEqual(self.client.get("/multi-prod.json").json()["port"], 3)
+        self.assertEqual([s["name"] for s in self.client.get("/multi.json").json()["propertySources"]
+                          if s["name"].startswith(url)], [f"{url} (document #0)"])
+
+
+class SearchPathTest(ServerTest):
+    def test_search_paths_are_expanded_per_request(self):
+        searchedFiles, _ = configserver.generateSearchPaths(
+            ["test", "application"], ["dev"], ["main"], ["yaml"], ["{application}", "/profiles/{profile}/"])
+        self.assertEqual(searchedFiles[:3], ["test-dev.yaml", "test/test-dev.yaml", "profiles/dev/test-dev.yaml"])
+        self.assertEqual(configserver.generateSearchPaths(["test"], [""], ["a", "b"], ["yaml"], ["{profile}"])[0],
+                         ["test.yaml", "test.yaml", "test.yaml", "test.yaml"])
+        self.assertTrue(configserver.isConfigFile("profiles/dev/test.yaml", ["profiles/{profile}"]))
+        self.assertFalse(configserver.isConfigFile("profiles/dev/x/test.yaml", ["profiles/{profile}"]))
+        self.assertFalse(configserver.isConfigFile("profiles/dev/test.yaml", []))
+
+    def test_placeholder_values_stay_single_directories(self):
+        self.assertEqual(configserver.searchDirectories(["{label}"], ["test"], [], "feature/x"), [""])
+        self.assertEqual(configserver.searchDirectories(["{label}"], ["test"], [], ".."), [""])
+        self.assertEqual(self.client.get("/%2E%2E/dev/main").status_code, 400)
+
+    def test_files_in_search_paths_are_served_from_one_tree(self):
+        self.files.update({"test/test-dev.yaml": b"port: 2\n", "profiles/dev/application.yaml": b"port: 3\n",
+                           "unrelated/test.yaml": b"port: 4\n"})
+        config = {"default": {"github": "r/r", "vault": "secret", "searchpaths": ["{application}", "profiles/{profile}"]}}
+        with patch.object(configserver.configreader, "getConfig", return_value=config):
+            sources = self.client.get("/test/dev/main").json()["propertySources"]
+            self.client.get("/test/prod/main")
+        self.assertEqual([source["name"][len("https://github.com/r/r/"):] for source in sources],
+                         ["test-dev.yaml", "test/test-dev.yaml", "application-dev.yaml",
+                          "application.yaml", "profiles/dev/application.yaml"])
+        self.assertEqual(len([r for r in self.github.requests if "/git/trees/" in r]), 1)
+
+
+class RateLimitTest(ServerTest):
+    def test_last_known_refs_are_served_while_rate_limited(self):
+        self.github.limit = self.github.remaining = 100
+        first = self.client.get("/test/dev/main").json()
+        self.assertEqual(githubclient.ratelimit["remaining"], 100 - 5)
+        self.assertIn('configserver_github_ratelimit{kind="remaining"} 95', self.client.get("/metrics").text)
+        self.github.remaining = 0
+        configserver.refcache.clear()
+        response = self.client.get("/test/dev/main")
+        self.assertEqual(response.json(), first)
+        self.assertNotIn("X-Config-Degraded", response.headers)
+        self.assertEqual(self.client.get("/test/dev/other").headers["X-Config-Degraded"], "github:other")
+
+    def test_low_budget_stretches_the_ref_ttl(self):
+        self.github.limit = self.github.remaining = 10
+        self.client.get("/test/dev/main")
+        self.assertIsNotNone(configserver.refcache.get(("r/r", "main")))
+        with patch.object(configserver.refcache, "clock", return_value=time.monotonic() + 60):
+            self.assertNotIn(("r/r", "main"), configserver.refcache)
+        configserver.refcache.clear()
+        self.client.get("/test/dev/main")
+        with patch.object(configserver.refcache, "clock", return_value=time.monotonic() + 60):
+            self.assertIn(("r/r", "main"), configserver.refcache)
+
+
+class WatchTest(ServerTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.interval = configserver.detector.interval
+        configserver.detector.interval = 0.05
+
+    def tearDown(self) -> None:
+        configserver.detector.interval = self.interval
+        return super().tearDown()
+
+    def test_long_poll_returns_once_the_commit_changes(self):
+        current = self.client.get("/test/dev/main").json()["version"]
+        self.assertEqual(self.client.get("/watch/test/dev/main").json()["version"], current)
+        self.assertEqual(self.client.get(f"/watch/test/dev/main?version={current}&timeout=0.1").status_code, 304)
+
+        def push():
+            time.sleep(0.2)
+            self.files["test-dev.yaml"] = b"a: changed\n"
+        pusher = threading.Thread(target=push)
+        pusher.start()
+        response = self.client.get(f"/watch/test/dev/main?version={current}&timeout=5")
+        pusher.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()["version"], current)
+        self.assertEqual(response.json()["version"], self.client.get("/test/dev/main").json()["version"])
+
+
+class MonitorTest(ServerTest):
+    push = {"ref": "refs/heads/main", "repository": {"full_name": "r/r"},
+            "commits": [{"added": [], "modified": ["test-dev.yaml", "README.md"], "removed": []}]}
+
+    def change(self):
+        first = self.client.get("/test/dev/main").json()["version"]
+        self.files["test-dev.yaml"] = b"a: changed\n"
+        self.assertEqual(self.client.get("/test/dev/main").json()["version"], first)
+        return first
+
+    def test_push_invalidates_the_pushed_ref(self):
+        first = self.change()
+        other = {**self.push, "repository": {"full_name": "x/y"}}
+        self.assertEqual(self.client.post("/monitor", json=other, headers={"X-Github-Event": "push"}).json(), [])
+        self.assertEqual(self.client.post("/monitor", json={**self.push, "ref": "refs/heads/other"}).json(),
+                         ["test", "test-dev"])
+        self.assertEqual(self.client.get("/test/dev/main").json()["version"], first)
+        response = self.client.post("/monitor", json=self.push, headers={"X-Github-Event": "push"})
+        self.assertEqual(response.json(), ["test", "test-dev"])
+        self.assertNotEqual(self.client.get("/test/dev/main").json()["version"], first)
+        self.assertEqual(self.client.post("/monitor", json=self.push, headers={"X-Github-Event": "ping"}).json(), [])
+
+    def test_shared_refs_are_dropped_before_the_response(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = sharedcache.SharedCache(os.path.join(tmp, "shared.db"))
+            shared.put("ref:r/r:main", "stale")
+            shared.put("ref:r/r:other", "kept")
+            try:
+                with patch.object(configserver, "shared", shared), \
+                        patch.object(configserver, "background", lambda coroutine: coroutine.close()):
+                    self.assertEqual(self.client.post("/monitor", json=self.push).status_code, 200)
+                self.assertIsNone(shared.get("ref:r/r:main"))
+                self.assertEqual(shared.get("ref:r/r:other"), "kept")
+            finally:
+                shared.close()
+
+    def test_malformed_payloads_are_rejected(self):
+        for body in [b"{", b"[]", b"\"push\""]:
+            self.assertEqual(self.client.post("/monitor", data=body).status_code, 400)
+
+    def test_webhook_signature_is_verified(self):
+        body = json.dumps(self.push).encode()
+        with patch.dict(configserver.configreader.monitorsettings, secret="s3cret"):
+            self.assertEqual(self.client.post("/monitor", data=body, headers={
+                "X-Hub-Signature-256": "sha256=00"}).status_code, 401)
+            signature = "sha256=" + hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+            self.assertEqual(self.client.post("/monitor", data=body, headers={
+                "X-Hub-Signature-256": signature}).status_code, 200)
+
+    def test_manual_refresh_needs_the_token(self):
+        first = self.change()
+        self.assertEqual(self.client.post("/refresh").status_code, 403)
+        with patch.dict(configserver.configreader.monitorsettings, token="t0ken"):
+            self.assertEqual(self.client.post("/refresh", headers={"Authorization": "Bearer nope"}).status_code, 401)
+            self.assertEqual(self.client.get("/test/dev/main").json()["version"], first)
+            response = self.client.post("/refresh", headers={"Authorization": "Bearer t0ken"})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json(), {"prefix": "default", "labels": ["main"]})
+        self.assertNotEqual(self.client.get("/test/dev/main").json()["version"], first)
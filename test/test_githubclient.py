@@ -0,0 +1,74 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import time
+import githubclient
+from test.fakegithub import FakeGithub, blobSha
+
+
+class GithubClientTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.files = {"application.yaml": b"a: b\n", "test-dev.properties": b"c=d\n", "sub/app.yaml": b"e: f\n"}
+        self.github = FakeGithub({"joe/config": {"main": self.files}}).start()
+        self.apiurl = githubclient.apiurl
+        githubclient.apiurl = self.github.url
+        githubclient.etags.clear()
+        githubclient.ratelimit.update(limit=None, remaining=None, reset=None, blocked=0.0)
+        return super().setUp()
+
+    async def asyncTearDown(self) -> None:
+        await githubclient.close()
+        githubclient.apiurl = self.apiurl
+        self.github.stop()
+
+    async def test_resolve_list_and_fetch(self):
+        sha = await githubclient.resolveRef("joe/config", "main")
+        self.assertEqual(sha, self.github.commitSha(self.files))
+        self.assertEqual(await githubclient.resolveRef("joe/config", sha), sha)
+        listing = await githubclient.listTree("joe/config", sha)
+        self.assertEqual(sorted(listing), [
+            ("application.yaml", blobSha(b"a: b\n")),
+            ("sub/app.yaml", blobSha(b"e: f\n")),
+            ("test-dev.properties", blobSha(b"c=d\n"))])
+        self.assertEqual(await githubclient.getBlob("joe/config", blobSha(b"c=d\n")), b"c=d\n")
+
+    async def test_truncated_trees_are_walked(self):
+        self.files["sub/deeper/x.properties"] = b"g=h\n"
+        sha = await githubclient.resolveRef("joe/config", "main")
+        self.github.truncate = True
+        self.assertEqual(sorted(await githubclient.listTree("joe/config", sha)), sorted(
+            (path, blobSha(content)) for path, content in self.files.items()))
+        self.assertEqual(len([r for r in self.github.requests if "/git/trees/" in r]), 4)
+
+    async def test_refs_are_revalidated_with_etags(self):
+        self.github.limit = self.github.remaining = 10
+        sha = await githubclient.resolveRef("joe/config", "main")
+        notmodified = githubclient.ratelimit["notmodified"]
+        self.assertEqual(await githubclient.resolveRef("joe/config", "main"), sha)
+        self.assertEqual(githubclient.ratelimit["notmodified"], notmodified + 1)
+        self.assertEqual(githubclient.ratelimit["remaining"], 9)
+        self.files["application.yaml"] = b"a: changed\n"
+        self.assertNotEqual(await githubclient.resolveRef("joe/config", "main"), sha)
+        self.assertEqual(githubclient.ratelimit["remaining"], 8)
+
+    async def test_spent_budget_blocks_requests_until_reset(self):
+        self.github.limit = self.github.remaining = 1
+        await githubclient.getBlob("joe/config", blobSha(b"a: b\n"))
+        self.assertTrue(githubclient.budgetLow(10))
+        with self.assertRaises(githubclient.RateLimited):
+            await githubclient.getBlob("joe/config", blobSha(b"c=d\n"))
+        requests = len(self.github.requests)
+        with self.assertRaises(githubclient.RateLimited):
+            await githubclient.resolveRef("joe/config", "main")
+        self.assertEqual(len(self.github.requests), requests)
+        self.assertGreater(githubclient.ratelimit["blocked"], time.time() + 3000)
+        githubclient.ratelimit["blocked"] = 0.0
+
+    async def test_unknown_ref_raises_not_found(self):
+        with self.assertRaises(githubclient.NotFound):
+            await githubclient.resolveRef("joe/config", "missing")
+
+    async def test_concurrent_requests_share_one_pool(self):
+        blobs = await asyncio.gather(
+            *[githubclient.getBlob("joe/config", blobSha(b"a: b\n")) for _ in range(10)])
+        self.assertEqual(set(blobs), {b"a: b\n"})
+        self.assertIs(githubclient.getClient(), githubclient.getClient())
@@ -0,0 +1,121 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import os
+import subprocess
+import tempfile
+import configserver
+import gitmirror
+from unittest.mock import patch
+
+
+def git(cwd, *args):
+    return subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                          cwd=cwd, check=True, capture_output=True).stdout.decode("utf-8").strip()
+
+
+class GitMirrorTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.origin = os.path.join(self.tmp.name, "origin")
+        os.makedirs(self.origin)
+        git(self.origin, "init", "-q", "-b", "main")
+        self.write("application.yaml", "foo:\n  bar: baz\n")
+        self.write("test-dev.properties", "a=b\n")
+        os.makedirs(os.path.join(self.origin, "test"))
+        self.write("test/test.yaml", "c: d\n")
+        git(self.origin, "add", ".")
+        git(self.origin, "commit", "-q", "-m", "init")
+        git(self.origin, "tag", "v1")
+        self.first = git(self.origin, "rev-parse", "HEAD")
+        gitmirror.mirrors.clear()
+        configserver.listingcache.clear()
+        configserver.sourcecache.clear()
+        self.mirror = {"url": f"file://{self.origin}", "path": os.path.join(self.tmp.name, "mirrors"), "interval": 60}
+        return super().setUp()
+
+    async def asyncTearDown(self) -> None:
+        await gitmirror.close()
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        with open(os.path.join(self.origin, path), "w") as file:
+            file.write(content)
+
+    async def test_lookups_are_served_from_the_mirror(self):
+        value = await configserver.getFromMirror(
+            "main", ["application.yaml", "test-dev.properties", "test/test.yaml"], "joe/config", self.mirror)
+        self.assertEqual(value, {
+            "https://github.com/joe/config/application.yaml": {"foo.bar": "baz"},
+            "https://github.com/joe/config/test/test.yaml": {"c": "d"},
+            "https://github.com/joe/config/test-dev.properties": {"a": "b"}})
+        self.assertEqual(await configserver.getFromMirror("nope", ["application.yaml"], "joe/config", self.mirror), {})
+
+    async def test_fetch_picks_up_new_commits_and_keeps_old_ones(self):
+        await configserver.getFromMirror("main", ["application.yaml"], "joe/config", self.mirror)
+        self.write("application.yaml", "foo:\n  bar: changed\n")
+        git(self.origin, "commit", "-q", "-am", "change")
+        await gitmirror.mirrors[self.mirror["url"]].fetch()
+        value = await configserver.getFromMirror("main", ["application.yaml"], "joe/config", self.mirror)
+        self.assertEqual(value["https://github.com/joe/config/application.yaml"], {"foo.bar": "changed"})
+        for ref in ["v1", self.first]:
+            value = await configserver.getFromMirror(ref, ["application.yaml"], "joe/config", self.mirror)
+            self.assertEqual(value["https://github.com/joe/config/application.yaml"], {"foo.bar": "baz"})
+
+    async def test_clone_outlives_cancelled_callers(self):
+        local = configserver.mirrorFor("joe/config", self.mirror)
+        real = asyncio.create_subprocess_exec
+        clones = []
+
+        async def slowGit(*args, **kwargs):
+            if "clone" in args:
+                clones.append(args)
+                await asyncio.sleep(0.3)
+            return await real(*args, **kwargs)
+        with patch.object(asyncio, "create_subprocess_exec", slowGit):
+            for _ in range(3):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(local.ensure(), 0.05)
+            self.assertFalse(local.cloned)
+            with self.assertRaises(gitmirror.GitError):
+                await local.resolveRef("main")
+            await local.ensure()
+        self.assertEqual(len(clones), 1)
+        self.assertEqual(await local.resolveRef("main"), self.first)
+        self.assertIsNone(await local.resolveRef("--output=x"))
+
+    async def test_closing_an_interrupted_clone_leaves_no_mirror_behind(self):
+        local = configserver.mirrorFor("joe/config", self.mirror)
+        real = asyncio.create_subprocess_exec
+        processes = []
+
+        async def slowGit(*args, **kwargs):
+            if "clone" in args:
+                args = ("sh", "-c", "exec sleep 5")
+            process = await real(*args, **kwargs)
+            processes.append(process)
+            return process
+        with patch.object(asyncio, "create_subprocess_exec", slowGit):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(local.ensure(), 0.2)
+            await local.close()
+        self.assertIsNotNone(processes[0].returncode)
+        self.assertFalse(local.cloned)
+        self.assertEqual(os.listdir(self.mirror["path"]) if os.path.isdir(self.mirror["path"]) else [], [])
+        self.assertEqual(local.refs, {})
+
+    async def test_token_is_not_on_the_command_line(self):
+        calls = []
+
+        async def recordingGit(*args, **kwargs):
+            calls.append((args, kwargs))
+            return await real(*args, **kwargs)
+        real = asyncio.create_subprocess_exec
+        local = gitmirror.Mirror("https://github.com/joe/config.git", os.path.join(self.tmp.name, "x.git"))
+        with patch.object(gitmirror, "githubtoken", return_value="s3cret"), \
+                patch.object(asyncio, "create_subprocess_exec", recordingGit):
+            with self.assertRaises(gitmirror.GitError):
+                await local.git("rev-parse", "--git-dir")
+        args, kwargs = calls[0]
+        self.assertFalse(any("Authorization" in arg for arg in args))
+        self.assertEqual(kwargs["env"]["GIT_CONFIG_KEY_0"], "http.extraHeader")
+        self.assertTrue(kwargs["env"]["GIT_CONFIG_VALUE_0"].startswith("Authorization: Basic "))
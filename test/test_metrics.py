@@ -0,0 +1,30 @@
+from unittest.case import TestCase
+import metrics
+
+
+class MetricsTest(TestCase):
+    def setUp(self) -> None:
+        self.registry = list(metrics.registry)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        metrics.registry[:] = self.registry
+        return super().tearDown()
+
+    def test_render_prometheus_text(self):
+        counter = metrics.Counter("test_total", "A counter.", ("prefix",))
+        counter.inc(prefix='a"b')
+        counter.inc(2, prefix='a"b')
+        histogram = metrics.Histogram("test_seconds", "A histogram.", ("source",), buckets=(0.1, 1))
+        histogram.observe(0.5, source="vault")
+        lines = metrics.render().splitlines()
+        self.assertIn("# TYPE test_total counter", lines)
+        self.assertIn('test_total{prefix="a\\"b"} 3', lines)
+        self.assertIn('test_seconds_bucket{source="vault",le="0.1"} 0', lines)
+        self.assertIn('test_seconds_bucket{source="vault",le="1"} 1', lines)
+        self.assertIn('test_seconds_bucket{source="vault",le="+Inf"} 1', lines)
+        self.assertIn('test_seconds_count{source="vault"} 1', lines)
+
+    def test_server_timing_sums_entries(self):
+        self.assertEqual(metrics.serverTiming([("parse", 0.001), ("github", 0.02), ("parse", 0.002)]),
+                         "parse;dur=3.0, github;dur=20.0")
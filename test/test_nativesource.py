@@ -0,0 +1,116 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.case import TestCase
+import os
+import tempfile
+from fastapi import HTTPException
+import configserver
+import nativesource
+
+
+class DirectoryTest(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.parsed = []
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+        return super().tearDown()
+
+    def write(self, name, content, mtime):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as file:
+            file.write(content)
+        os.utime(path, ns=(mtime, mtime))
+
+    def parse(self, name, content):
+        self.parsed.append(name)
+        return content.decode("utf-8")
+
+    def test_files_are_parsed_again_only_after_a_change(self):
+        directory = nativesource.Directory(self.tmp.name)
+        self.write("application.yaml", "a", 1000)
+        found, version = directory.lookup(["application.yaml", "test.yaml"], self.parse)
+        self.assertEqual(found, {"application.yaml": "a"})
+        self.assertEqual(directory.lookup(["application.yaml"], self.parse), (found, version))
+        self.write("application.yaml", "b", 2000)
+        found, changed = directory.lookup(["application.yaml"], self.parse)
+        self.assertEqual(found, {"application.yaml": "b"})
+        self.assertNotEqual(changed, version)
+        self.assertEqual(self.parsed, ["application.yaml", "application.yaml"])
+        os.remove(os.path.join(self.tmp.name, "application.yaml"))
+        self.assertEqual(directory.lookup(["application.yaml"], self.parse)[0], {})
+
+    def test_names_may_not_leave_the_directory(self):
+        os.mkdir(os.path.join(self.tmp.name, "cfg"))
+        self.write("application.yaml", "secret", 1000)
+        directory = nativesource.Directory(os.path.join(self.tmp.name, "cfg"))
+        self.assertEqual(directory.lookup(["../application.yaml", "cfg/../../application.yaml"], self.parse)[0], {})
+        self.assertEqual(self.parsed, [])
+
+    def test_directories_are_bounded(self):
+        maxsize = nativesource.directories.maxsize
+        nativesource.directories.maxsize = 2
+        try:
+            for name in ["a", "b", "c"]:
+                nativesource.getDirectory(os.path.join(self.tmp.name, name))
+            self.assertEqual(len(nativesource.directories), 2)
+            self.assertNotIn(os.path.join(self.tmp.name, "a"), nativesource.directories)
+        finally:
+            nativesource.directories.maxsize = maxsize
+            nativesource.directories.clear()
+
+    def test_labels_stay_inside_the_configured_directory(self):
+        native = {"path": os.path.join(self.tmp.name, "{label}")}
+        self.assertEqual(configserver.nativePath(native, "main"), os.path.join(self.tmp.name, "main"))
+        for label in [".", "..", "../etc", "a/b", "/etc"]:
+            with self.assertRaises(HTTPException) as raised:
+                configserver.nativePath(native, label)
+            self.assertEqual(raised.exception.status_code, 400)
+        self.assertEqual(configserver.nativePath({"path": self.tmp.name}, ".."), self.tmp.name)
+
+
+class NativeBackendTest(IsolatedAsyncioTestCase):
+    async def test_combine_serves_native_prefix(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, content in [("application.yaml", "a:\n  b: base\n"), ("test-dev.properties", "a.b=dev\n")]:
+                with open(os.path.join(tmp, name), "w") as file:
+                    file.write(content)
+            settings = {**configserver.configreader.prefixdefaults, "github": "unused", "vault": "secret",
+                        "source": "native", "native": {"path": tmp, "interval": 0}}
+            combined = await configserver.combine(["test", "application"], ["dev"], ["main"], None,
+                                                  github="unused", settings=settings, prefix="native")
+        self.assertEqual([source["name"] for source in combined["propertySources"]],
+                         [f"file:{tmp}/test-dev.properties", f"file:{tmp}/application.yaml"])
+        self.assertIsNotNone(combined["version"])
+
+    async def test_default_directory_is_the_bundled_springconfig(self):
+        settings = {**configserver.configreader.prefixdefaults, "github": "unused", "vault": "secret",
+                    "source": "native"}
+        combined = await configserver.combine(["test", "application"], ["default"], ["main"], None,
+                                              github="unused", settings=settings, prefix="native")
+        self.assertEqual([source["name"] for source in combined["propertySources"]],
+                         [f"file:{os.path.abspath('springconfig')}/application.yaml"])
+
+    async def test_search_paths_may_not_leave_the_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, "cfg"))
+            with open(os.path.join(tmp, "application.yaml"), "w") as file:
+                file.write("a: outside\n")
+            settings = {**configserver.configreader.prefixdefaults, "github": "unused", "vault": "secret",
+                        "source": "native", "native": {"path": os.path.join(tmp, "cfg"), "interval": 0},
+                        "searchpaths": ["{application}", "{profile}"]}
+            for applications, profiles in [(["..", "application"], ["default"]), (["application"], ["../x"])]:
+                with self.assertRaises(HTTPException) as raised:
+                    await configserver.combine(applications, profiles, ["main"], None,
+                                               github="unused", settings=settings, prefix="native")
+                self.assertEqual(raised.exception.status_code, 400)
+
+    async def test_native_label_may_not_leave_the_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings = {**configserver.configreader.prefixdefaults, "github": "unused", "vault": "secret",
+                        "source": "native", "native": {"path": os.path.join(tmp, "{label}"), "interval": 0}}
+            with self.assertRaises(HTTPException) as raised:
+                await configserver.combine(["application"], ["default"], [".."], None,
+                                           github="unused", settings=settings, prefix="native")
+        self.assertEqual(raised.exception.status_code, 400)
@@ -0,0 +1,70 @@
+from unittest.case import TestCase
+import copy
+import json
+import pickle
+
+import parsers
+
+
+class PropertiesTest(TestCase):
+    def parse(self, content):
+        documents = parsers.parseProperties(content)
+        self.assertEqual(len(documents), 1)
+        return documents[0][1]
+
+    def test_separators(self):
+        self.assertEqual(self.parse(b"a=1\nb: 2\nc 3\nd = 4\ne\t:\t5\nf\ng=\nh==6\n"),
+                         {"a": "1", "b": "2", "c": "3", "d": "4", "e": "5", "f": "", "g": "", "h": "=6"})
+
+    def test_comments_and_blank_lines(self):
+        self.assertEqual(self.parse(b"# comment\n! other=comment\n\n   \n  a=1\r\nb=2 # not a comment\n"),
+                         {"a": "1", "b": "2 # not a comment"})
+
+    def test_escapes(self):
+        self.assertEqual(self.parse(b"key\\ with\\:colon=tab\\there\nuni=\\u00e9\\\\\nurl=http\\://x\n"),
+                         {"key with:colon": "tab\there", "uni": "\u00e9\\", "url": "http://x"})
+
+    def test_continuation_lines(self):
+        self.assertEqual(self.parse(b"list=a,\\\n    b,\\\n    c\nnext=1\nback=slash\\\\\n"),
+                         {"list": "a,b,c", "next": "1", "back": "slash\\"})
+
+
+class YamlTest(TestCase):
+    content = (b"a: 1\nspring:\n  application:\n    name: test\n---\nspring:\n  config:\n    activate:\n"
+               b"      on-profile: dev | test\na: 2\n---\nspring.profiles: '!dev'\na: 3\n---\n")
+
+    def test_documents_carry_their_activation(self):
+        documents = parsers.parseYaml(self.content)
+        self.assertEqual([activation for activation, _ in documents], [None, ("dev", "test"), ("!dev",)])
+        self.assertEqual(documents[0][1], {"a": 1, "spring.application.name": "test"})
+
+    def test_select_by_profile(self):
+        documents = parsers.parseYaml(self.content)
+        self.assertEqual([i for i, _ in documents.select(["dev"])], [1, 0])
+        self.assertEqual([i for i, _ in documents.select(["test"])], [2, 1, 0])
+        self.assertEqual([i for i, _ in documents.select([])], [2, 0])
+
+    def test_parse_results_are_cached_by_content(self):
+        parsers.parsecache.clear()
+        first = parsers.parse("a.yaml", self.content)
+        self.assertIs(parsers.parse("other/b.yml", self.content), first)
+        self.assertIsNot(parsers.parse("a.properties", self.content), first)
+        self.assertEqual(len(parsers.parsecache), 2)
+
+
+class ImmutablePropertiesTest(TestCase):
+    def test_properties_are_immutable(self):
+        properties = parsers.parse("a.yaml", b"a:\n  b: 1\n")[0][1]
+        for change in [lambda: properties.update(c=2), lambda: properties.__setitem__("c", 2),
+                       lambda: properties.pop("a.b"), properties.clear]:
+            with self.assertRaises(TypeError):
+                change()
+        self.assertEqual(properties, {"a.b": 1})
+        self.assertIs(copy.deepcopy(properties), properties)
+        self.assertEqual(pickle.loads(pickle.dumps(properties)), properties)
+        self.assertEqual(json.loads(json.dumps(properties)), {"a.b": 1})
+
+    def test_keys_are_interned(self):
+        first = parsers.parseYaml(b"spring:\n  datasource:\n    url: a\n")[0][1]
+        second = parsers.parseProperties(b"spring.datasource.url=b")[0][1]
+        self.assertIs(next(iter(first)), next(iter(second)))
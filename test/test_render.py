@@ -0,0 +1,36 @@
+from unittest.case import TestCase
+import json
+import yaml
+import render
+
+propertySources = [
+    {"name": "vault:test", "source": {"spring.datasource.password": "secret"}},
+    {"name": "test.yaml", "source": {"spring.datasource.password": "wrong", "spring.datasource.url": "jdbc", "port": 8080}},
+]
+
+
+class RenderTest(TestCase):
+    def setUp(self) -> None:
+        render.renders.clear()
+        return super().setUp()
+
+    def test_earlier_sources_win(self):
+        self.assertEqual(render.mergeSources(propertySources), {
+            "spring.datasource.password": "secret", "spring.datasource.url": "jdbc", "port": 8080})
+
+    def test_wide_map(self):
+        self.assertEqual(render.generateWideMap({"a.b.c": 1, "a.b.d": 2, "a.e": 3, "a.e.f": 4, "a.a": 5}),
+                         {"a": {"b": {"c": 1, "d": 2}, "e": 3, "a": 5}})
+
+    def test_formats(self):
+        self.assertEqual(render.render(propertySources, "properties"),
+                         b"spring.datasource.password=secret\nspring.datasource.url=jdbc\nport=8080")
+        self.assertEqual(yaml.safe_load(render.render(propertySources, "yml")),
+                         {"spring": {"datasource": {"password": "secret", "url": "jdbc"}}, "port": 8080})
+        self.assertEqual(json.loads(render.render(propertySources, "json")), render.mergeSources(propertySources))
+
+    def test_bodies_are_memoized_per_tag_and_format(self):
+        body = render.render(propertySources, "json", '"tag"')
+        self.assertIs(render.render([], "json", '"tag"'), body)
+        self.assertNotEqual(render.render([], "json", '"other"'), body)
+        self.assertEqual(render.render([], "yml", '"tag"'), b"{}\n")
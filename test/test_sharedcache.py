@@ -0,0 +1,81 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+from unittest.mock import patch
+import datetime
+import os
+import pickle
+import tempfile
+import parsers
+import sharedcache
+
+
+class SharedCacheTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "shared.db")
+        # two instances on the same file behave like two worker processes
+        self.workers = [sharedcache.SharedCache(path, leasetime=2) for _ in range(2)]
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        for worker in self.workers:
+            worker.close()
+        self.tmp.cleanup()
+        return super().tearDown()
+
+    async def test_only_one_worker_fetches_a_key(self):
+        fetches = []
+
+        async def fetch():
+            fetches.append(1)
+            await asyncio.sleep(0.1)
+            return {"a.b": ["c"]}
+        values = await asyncio.gather(*[worker.lookup("source:r:1", fetch) for worker in self.workers * 3])
+        self.assertEqual(values, [{"a.b": ["c"]}] * 6)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(self.workers[1]), 1)
+
+    async def test_entries_with_ttl_expire(self):
+        self.workers[0].put("ref:r:main", "sha", ttl=-1)
+        self.assertIsNone(self.workers[1].get("ref:r:main"))
+        self.workers[0].put("ref:r:main", "sha", ttl=60)
+        self.assertEqual(self.workers[1].get("ref:r:main"), "sha")
+
+    def test_lease_is_exclusive_until_released(self):
+        self.assertTrue(self.workers[0].acquire("k"))
+        self.assertTrue(self.workers[0].acquire("k"))
+        self.assertFalse(self.workers[1].acquire("k"))
+        self.workers[0].release("k")
+        self.assertTrue(self.workers[1].acquire("k"))
+
+    def test_parsed_files_round_trip_without_pickle(self):
+        documents = parsers.parse("multi.yaml", b"a: 1\nwhen: 2021-01-02\nlist: [x, {y: 1.5}]\n---\n"
+                                                b"spring.config.activate.on-profile: dev\nb: !!binary aGk=\n")
+        self.workers[0].put("source:yaml:1", documents)
+        self.workers[0].put("tree:r:1", {"a.yaml": "1"})
+        value = self.workers[1].get("source:yaml:1")
+        self.assertEqual(value, documents)
+        self.assertIsInstance(value, parsers.Documents)
+        self.assertIsInstance(value[0][1], parsers.Properties)
+        self.assertEqual(value[0][1]["when"], datetime.date(2021, 1, 2))
+        self.assertEqual(value[1][1]["b"], b"hi")
+        self.assertEqual(self.workers[1].get("tree:r:1"), {"a.yaml": "1"})
+
+    def test_pickled_entries_are_not_loaded(self):
+        class Exploit:
+            def __reduce__(self):
+                return (os.system, ("false",))
+        with self.workers[0].lock:
+            self.workers[0].connection.execute(
+                "INSERT INTO entries (key, value, created, expires) VALUES (?, ?, 0, NULL)",
+                ("ref:r:main", pickle.dumps(Exploit())))
+        with patch("os.system") as system:
+            self.assertIsNone(self.workers[1].get("ref:r:main"))
+        system.assert_not_called()
+
+    def test_databases_of_other_users_are_refused(self):
+        uid = os.getuid()
+        with patch("os.getuid", return_value=uid + 1):
+            with self.assertRaises(PermissionError):
+                sharedcache.SharedCache(os.path.join(self.tmp.name, "shared.db"))
+        self.assertEqual(os.stat(os.path.join(self.tmp.name, "shared.db")).st_mode & 0o777, 0o600)
@@ -0,0 +1,136 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock, patch
+import threading
+import hvac
+import vaultclient
+from test.fakevault import FakeVault
+
+
+class VaultClientTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        vaultclient.clients.clear()
+        return super().setUp()
+
+    def test_clients_are_pooled_per_token_and_address(self):
+        with patch("vaultclient.hvac.Client") as client:
+            first = vaultclient.getClient("http://vault:8200", "a")
+            self.assertIs(vaultclient.getClient("http://vault:8200", "a"), first)
+            vaultclient.getClient("http://vault:8200", "b")
+            vaultclient.getClient("http://other:8200", "a")
+            self.assertEqual(client.call_count, 3)
+        self.assertNotIn("a", [key[1] for key in vaultclient.clients.entries])
+
+    async def test_missing_secrets_are_none_and_failures_raise(self):
+        client = MagicMock()
+        secrets = {"app": {"data": {"data": {"a": "b"}}}}
+
+        def read(path, mount_point):
+            if path == "broken":
+                raise hvac.exceptions.InternalServerError("sealed")
+            if path not in secrets:
+                raise hvac.exceptions.InvalidPath()
+            return secrets[path]
+        client.secrets.kv.read_secret_version.side_effect = read
+        vaultclient.clients.put(("http://vault:8200", vaultclient.tokenHash("t")), client)
+        self.assertEqual(await vaultclient.readSecret("http://vault:8200", "t", "secret", "app"), secrets["app"])
+        self.assertIsNone(await vaultclient.readSecret("http://vault:8200", "t", "secret", "app,dev"))
+        with self.assertRaises(hvac.exceptions.InternalServerError):
+            await vaultclient.readSecret("http://vault:8200", "t", "secret", "broken")
+
+
+    async def test_reads_run_on_the_vault_threads(self):
+        threads = []
+        client = MagicMock()
+        client.secrets.kv.read_secret_version.side_effect = lambda path, mount_point: threads.append(
+            threading.current_thread().name)
+        vaultclient.clients.put(("http://vault:8200", vaultclient.tokenHash("t")), client)
+        await vaultclient.readSecret("http://vault:8200", "t", "secret", "app")
+        self.assertTrue(threads[0].startswith("vault"))
+
+    def test_concurrent_evictions_do_not_break_lookups(self):
+        maxsize = vaultclient.clients.maxsize
+        vaultclient.clients.maxsize = 2
+        errors = []
+
+        def use(offset):
+            try:
+                for i in range(300):
+                    vaultclient.getClient("http://vault:8200", str((i + offset) % 5))
+            except Exception as e:
+                errors.append(e)
+        try:
+            with patch("vaultclient.hvac.Client"):
+                workers = [threading.Thread(target=use, args=(offset,)) for offset in range(8)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+        finally:
+            vaultclient.clients.maxsize = maxsize
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(vaultclient.clients), 2)
+
+
+class VaultSecretCacheTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        vaultclient.clients.clear()
+        vaultclient.secretcache.clear()
+        self.version = 1
+        self.client = MagicMock()
+        self.client.secrets.kv.read_secret_version.side_effect = lambda path, mount_point: {
+            "data": {"data": {"v": self.version}, "metadata": {"version": self.version}}}
+        self.client.secrets.kv.read_secret_metadata.side_effect = lambda path, mount_point: {
+            "data": {"current_version": self.version}}
+        vaultclient.clients.put(("http://vault:8200", vaultclient.tokenHash("t")), self.client)
+        return super().setUp()
+
+    async def read(self, ttl):
+        secret = await vaultclient.readCachedSecret("http://vault:8200", "t", "secret", "app", ttl)
+        return secret["data"]["data"]["v"]
+
+    async def test_fresh_entries_are_served_from_cache(self):
+        self.assertEqual(await self.read(60), 1)
+        self.version = 2
+        self.assertEqual(await self.read(60), 1)
+        self.assertEqual(self.client.secrets.kv.read_secret_version.call_count, 1)
+
+    async def test_expired_entries_are_revalidated_by_version(self):
+        await self.read(0)
+        self.assertEqual(await self.read(0), 1)
+        self.assertEqual(self.client.secrets.kv.read_secret_version.call_count, 1)
+        self.version = 2
+        self.assertEqual(await self.read(0), 2)
+        self.assertEqual(self.client.secrets.kv.read_secret_version.call_count, 2)
+
+    async def test_secrets_of_a_mount_can_be_forgotten(self):
+        await self.read(60)
+        await vaultclient.readCachedSecret("http://vault:8200", "t", "other", "app", 60)
+        vaultclient.forgetSecrets("http://vault:8200", "secret")
+        self.assertEqual([key[2] for key in vaultclient.secretcache.entries], ["other"])
+
+    async def test_entries_are_isolated_per_token(self):
+        await self.read(60)
+        other = MagicMock()
+        other.secrets.kv.read_secret_version.side_effect = hvac.exceptions.Forbidden()
+        vaultclient.clients.put(("http://vault:8200", vaultclient.tokenHash("u")), other)
+        self.assertIsNone(await vaultclient.readCachedSecret("http://vault:8200", "u", "secret", "app", 60))
+
+
+class FakeVaultTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.vault = FakeVault({"secret": {"app": {"a": "b"}}}).start()
+        vaultclient.clients.clear()
+        vaultclient.secretcache.clear()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.vault.stop()
+        return super().tearDown()
+
+    async def test_reads_kv_v2_over_http(self):
+        self.assertEqual((await vaultclient.readSecret(self.vault.url, "t", "secret", "app"))["data"]["data"], {"a": "b"})
+        self.assertIsNone(await vaultclient.readSecret(self.vault.url, "t", "secret", "app,dev"))
+        await vaultclient.readCachedSecret(self.vault.url, "t", "secret", "app", 0)
+        self.vault.put("secret", "app", {"a": "c"})
+        secret = await vaultclient.readCachedSecret(self.vault.url, "t", "secret", "app", 0)
+        self.assertEqual((secret["data"]["data"], secret["data"]["metadata"]["version"]), ({"a": "c"}, 2))
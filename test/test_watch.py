@@ -0,0 +1,53 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+
+import watch
+
+
+class ChangeDetectorTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.version = "v1"
+        self.checks = 0
+        self.refreshed = []
+
+        async def refresh(sources):
+            self.refreshed.append(sources)
+        self.detector = watch.ChangeDetector(interval=0.05, refresh=refresh)
+        return super().setUp()
+
+    async def asyncTearDown(self) -> None:
+        await self.detector.close()
+
+    async def check(self):
+        self.checks += 1
+        return self.version
+
+    async def test_watchers_share_one_check_per_interval(self):
+        waiters = [asyncio.ensure_future(self.detector.wait("key", "v1", self.check, 5, [("ref", "r", "main")]))
+                   for _ in range(1000)]
+        # the checks of a round run after its refresh, wait for both
+        while not self.refreshed or self.checks < 2:
+            await asyncio.sleep(0.01)
+        # the first check and one per round, not one per watcher
+        self.assertLessEqual(self.checks, len(self.refreshed) + 1)
+        self.assertEqual(self.refreshed[0], {("ref", "r", "main")})
+        self.version = "v2"
+        self.assertEqual(set(await asyncio.gather(*waiters)), {"v2"})
+        self.assertEqual(await self.detector.wait("key", "v1", self.check, 5), "v2")
+
+    async def test_unchanged_version_times_out(self):
+        self.assertIsNone(await self.detector.wait("key", "v1", self.check, 0.1))
+        self.assertEqual(await self.detector.wait("key", None, self.check, 0.1), "v1")
+
+    async def test_unwatched_keys_are_dropped(self):
+        await self.detector.wait("key", "v1", self.check, 0.01)
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.detector.watches, {})
+
+    async def test_events(self):
+        stream = watch.events(self.detector, "key", None, self.check, 0.1, payload={"name": "test"})
+        self.assertEqual(await stream.__anext__(), 'event: change\ndata: {"name": "test", "version": "v1"}\n\n')
+        self.assertEqual(await stream.__anext__(), ": keepalive\n\n")
+        self.version = "v2"
+        self.assertEqual(await stream.__anext__(), 'event: change\ndata: {"name": "test", "version": "v2"}\n\n')
+        await stream.aclose()
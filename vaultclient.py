@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import threading
+import time
+
+import hvac
+import requests
+
+import cache
+
+# (vault address, token hash) -> hvac.Client, every client keeps its own keep-alive session
+clients = cache.LRUCache(maxsize=64)
+poolsize = 20
+# (vault address, token hash, mount, path) -> (checked at, version, secret), scoped by token so that a token never
+# sees secrets read with another token
+secretcache = cache.LRUCache(maxsize=1024)
+# clients and secretcache are used from the reader threads, an eviction must not interleave with a lookup
+lock = threading.Lock()
+# vault reads get their own threads, so a slow vault cannot take all threads of asyncio.to_thread
+executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=poolsize, thread_name_prefix="vault"
+)
+
+
+def tokenHash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def getClient(address, token):
+    key = (address, tokenHash(token))
+    with lock:
+        client = clients.get(key)
+    if client is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=poolsize, pool_maxsize=poolsize
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        client = hvac.Client(
+            url=address, token=token, verify=False, timeout=10, session=session
+        )
+        with lock:
+            # another thread may have created one in the meantime
+            existing = clients.get(key)
+            client = clients.put(key, client) if existing is None else existing
+    return client
+
+
+async def run(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(function, *args)
+    )
+
+
+def readSecretSync(address, token, mount, path):
+    try:
+        return getClient(address, token).secrets.kv.read_secret_version(
+            path=path, mount_point=mount
+        )
+    except (hvac.exceptions.InvalidPath, hvac.exceptions.Forbidden):
+        return None
+
+
+async def readSecret(address, token, mount, path):
+    """
+    Reads a kv v2 secret without blocking the event loop. Returns None if the secret does not exist or the token may
+    not read it, every other failure (timeouts, sealed vault, server errors) is raised.
+    """
+    return await run(readSecretSync, address, token, mount, path)
+
+
+def readCachedSecretSync(address, token, mount, path, ttl):
+    key = (address, tokenHash(token), mount, path)
+    with lock:
+        entry = secretcache.get(key)
+    now = time.monotonic()
+    if entry is not None and entry[0] + ttl > now:
+        return entry[2]
+    if entry is not None and entry[1] is not None:
+        try:
+            metadata = getClient(address, token).secrets.kv.read_secret_metadata(
+                path=path, mount_point=mount
+            )
+            if metadata["data"]["current_version"] == entry[1]:
+                with lock:
+                    secretcache.put(key, (now, entry[1], entry[2]))
+                return entry[2]
+        except hvac.exceptions.Forbidden:
+            # the token may read the secret but not its metadata
+            pass
+        except hvac.exceptions.InvalidPath:
+            with lock:
+                secretcache.put(key, (now, None, None))
+            return None
+    secret = readSecretSync(address, token, mount, path)
+    version = secret["data"]["metadata"]["version"] if secret is not None else None
+    with lock:
+        secretcache.put(key, (now, version, secret))
+    return secret
+
+
+def checkTokenSync(address, token):
+    getClient(address, token).auth.token.lookup_self()
+
+
+async def checkToken(address, token):
+    """
+    Raises hvac.exceptions.Forbidden unless vault accepts token, e.g. once it expired or was revoked.
+    """
+    await run(checkTokenSync, address, token)
+
+
+async def readCachedSecret(address, token, mount, path, ttl):
+    """
+    Like readSecret, but answers from the cache for ttl seconds. Afterwards the current_version of the secret metadata
+    decides whether the cached secret is still valid or has to be read again. Missing secrets are cached as well.
+    """
+    return await run(readCachedSecretSync, address, token, mount, path, ttl)
+
+
+def forgetSecrets(address, mount):
+    """
+    Drops the cached secrets of a mount, read with any token.
+    """
+    with lock:
+        for key in [key for key in secretcache.entries if key[0] == address and key[2] == mount]:
+            secretcache.pop(key)
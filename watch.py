@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("configserver")
+
+
+class Watch:
+    """
+    A watched request: how to check its version, the version seen last, the upstream sources it depends on and the
+    futures of everyone waiting for it to change.
+    """
+
+    def __init__(self, check, sources=()):
+        self.check = check
+        # the first check, shared by everyone who starts watching before it is done
+        self.initial = asyncio.ensure_future(check())
+        self.version = None
+        self.sources = frozenset(sources)
+        self.waiters = set()
+
+
+class ChangeDetector:
+    """
+    Checks every watched request once per interval in a single background loop, no matter how many clients wait for
+    it. refresh(sources) is awaited before each round with the union of the sources of all watches, so every upstream
+    source is checked once per round as well.
+    """
+
+    def __init__(self, interval=10, refresh=None):
+        self.interval = interval
+        self.refresh = refresh
+        self.watches = {}
+        self.task = None
+
+    async def wait(self, key, version, check, timeout, sources=()):
+        """
+        Returns the current version of key as soon as it differs from version, None if it did not change within
+        timeout seconds. check() is awaited for the version the first time key is watched.
+        """
+        watch = self.watches.get(key)
+        if watch is None:
+            watch = self.watches[key] = Watch(check, sources)
+        if watch.version is None:
+            try:
+                watch.version = await asyncio.shield(watch.initial)
+            except Exception:
+                if self.watches.get(key) is watch:
+                    del self.watches[key]
+                raise
+        if watch.version is not None and watch.version != version:
+            return watch.version
+        future = asyncio.get_running_loop().create_future()
+        watch.waiters.add(future)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            watch.waiters.discard(future)
+
+    async def run(self):
+        while self.watches:
+            await asyncio.sleep(self.interval)
+            # watches nobody waited for during a whole interval are dropped
+            for key in [
+                key
+                for key, watch in self.watches.items()
+                if not watch.waiters and watch.initial.done()
+            ]:
+                del self.watches[key]
+            await self.check()
+
+    async def check(self):
+        watches = list(self.watches.values())
+        if self.refresh is not None:
+            try:
+                await self.refresh(frozenset().union(*[watch.sources for watch in watches]))
+            except Exception as e:
+                logger.warning(f"watch: refreshing sources failed: {e}")
+        versions = await asyncio.gather(
+            *[watch.check() for watch in watches], return_exceptions=True
+        )
+        for watch, version in zip(watches, versions):
+            if isinstance(version, Exception):
+                logger.warning(f"watch: check failed: {version}")
+                continue
+            if version is None or version == watch.version:
+                continue
+            watch.version = version
+            for future in watch.waiters:
+                if not future.done():
+                    future.set_result(version)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for watch in self.watches.values():
+            watch.initial.cancel()
+        self.watches.clear()
+
+
+async def events(detector, key, version, check, keepalive, sources=(), payload=None):
+    """
+    Server-sent events for a watched request: a "change" event with the new version whenever it changes (right away
+    if version is not the current one) and a comment every keepalive seconds to keep the connection open.
+    """
+    payload = payload or {}
+    while True:
+        changed = await detector.wait(key, version, check, keepalive, sources)
+        if changed is None:
+            yield ": keepalive\n\n"
+            continue
+        version = changed
+        yield f"event: change\ndata: {json.dumps({**payload, 'version': version})}\n\n"